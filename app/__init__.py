@@ -205,6 +205,26 @@ def create_app(config_object=None):
         'LLM_CACHE_MIN_UPDATE': 'llm_cache_update_interval_minutes',
         'LLM_BACKEND_TIMEOUT': 'LLM_BACKEND_TIMEOUT',
         'SYSTEM_ADMIN_EMAIL': 'SYSTEM_ADMIN_EMAIL',
+        'DISTRIBUTED_SCRAPING': 'DISTRIBUTED_SCRAPING',
+        'SEARCH_CACHE_TTL': 'SEARCH_CACHE_TTL',
+        'PAGE_CACHE_TTL': 'PAGE_CACHE_TTL',
+        'PAGE_CONTEXT_MAX_CHARS': 'PAGE_CONTEXT_MAX_CHARS',
+        'SCRAPE_POOL_SIZE': 'SCRAPE_POOL_SIZE',
+        'ROUTING_NATIVE_TOOLS': 'ROUTING_NATIVE_TOOLS',
+        'ROUTING_DECISION_CACHE_TTL': 'ROUTING_DECISION_CACHE_TTL',
+        'SPECULATIVE_SEARCH': 'SPECULATIVE_SEARCH',
+        'ROUTER_DIRECT_ANSWER': 'ROUTER_DIRECT_ANSWER',
+        'ROUTING_HEURISTICS': 'ROUTING_HEURISTICS',
+        'ROUTING_JSON_SCHEMA': 'ROUTING_JSON_SCHEMA',
+        'CELERY_SERIALIZER': 'CELERY_SERIALIZER',
+        'CELERY_COMPRESSION': 'CELERY_COMPRESSION',
+        'CELERY_PREFETCH_MULTIPLIER': 'CELERY_PREFETCH_MULTIPLIER',
+        'CELERY_SCRAPE_QUEUE': 'CELERY_SCRAPE_QUEUE',
+        'INLINE_SYNC_ORCHESTRATION': 'INLINE_SYNC_ORCHESTRATION',
+        'SYNTHESIS_STREAMING': 'SYNTHESIS_STREAMING',
+        'ORCHESTRATION_DEDUP_TTL': 'ORCHESTRATION_DEDUP_TTL',
+        'SYNTHESIS_TOOL_CONTEXT_TOKENS': 'SYNTHESIS_TOOL_CONTEXT_TOKENS',
+        'SYNTHESIS_HISTORY_MESSAGES': 'SYNTHESIS_HISTORY_MESSAGES',
     }
 
     for env_key, config_key in env_to_config_map.items():
@@ -287,6 +307,24 @@ def create_app(config_object=None):
         app.config['message_queue'] = broker_url
     if result_backend := app.config.get('CELERY_RESULT_BACKEND'):
         app.config['result_backend'] = result_backend
+    # Format des messages Celery (historique de conversation en argument, réponse finale en résultat).
+    # 'msgpack' est plus compact que JSON ; le JSON reste accepté pour les messages déjà en file.
+    if serializer := app.config.get('CELERY_SERIALIZER'):
+        app.config['task_serializer'] = serializer
+        app.config['result_serializer'] = serializer
+        app.config['accept_content'] = sorted({serializer, 'json'})
+    if compression := app.config.get('CELERY_COMPRESSION'):
+        app.config['task_compression'] = compression
+        app.config['result_compression'] = compression
+
+    # Normaliser l'URL de SearXNG une fois pour toutes : les tâches y concatènent directement '/search'.
+    if searxng_base_url := app.config.get('SEARXNG_BASE_URL'):
+        app.config['SEARXNG_BASE_URL'] = searxng_base_url.strip().rstrip('/')
+
+    # Index des backends par nom : chaque appel LLM (routage, synthèse, basculement) résout son backend.
+    app.config['LLM_BACKENDS_BY_NAME'] = {
+        backend['name']: backend for backend in app.config.get('llm_backends', []) if backend.get('name')
+    }
 
     # --- Journalisation de la configuration finale ---
     app.logger.info("="*50)
@@ -333,6 +371,10 @@ def create_app(config_object=None):
     from .auth import _initialize_users
     _initialize_users(app)
 
+    # Pré-sérialiser la liste des outils pour le prompt de routage
+    from .tools_definitions import _initialize_tools
+    _initialize_tools(app)
+
     # Initialiser Flask-Caching
     flask_cache.init_app(app)
 
@@ -1,10 +1,22 @@
 # app/cache.py
 
+import hashlib
+
 from .extensions import flask_cache
 
 # Clé de cache pour la liste des modèles
 MODELS_CACHE_KEY = "llm_models_list"
 
+# Préfixe des clés de cache pour les décisions de routage du LLM
+DECISION_CACHE_PREFIX = "llm_decision"
+
+# Préfixes des clés de cache pour les résultats des outils web
+SEARCH_CACHE_PREFIX = "sw"
+PAGE_CACHE_PREFIX = "rw"
+
+# Préfixe des clés associant une conversation déjà soumise à l'identifiant de sa tâche d'orchestration
+ORCHESTRATION_CACHE_PREFIX = "orch"
+
 def get_models_from_cache():
     """
     Récupère le dictionnaire des modèles depuis le cache.
@@ -24,3 +36,55 @@ def get_model_details(model_id):
     models = get_models_from_cache()
     # La recherche est maintenant une simple consultation de dictionnaire, O(1)
     return models.get(model_id)
+
+def _hashed_key(prefix, value):
+    """Construit une clé de cache courte et de taille fixe à partir d'une valeur arbitraire."""
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).hexdigest()
+    return f"{prefix}:{digest}"
+
+def _normalize_text_key(text):
+    """Normalise une question ou une requête avant hachage : casse et blancs (espaces multiples, retours à la ligne) ignorés."""
+    return " ".join(text.split()).lower()
+
+def _decision_cache_key(model_name, user_question):
+    """Construit la clé de cache d'une décision à partir du modèle et de la question normalisée."""
+    return _hashed_key(f"{DECISION_CACHE_PREFIX}:{model_name}", _normalize_text_key(user_question))
+
+def get_cached_decision(model_name, user_question):
+    """Récupère une décision de routage déjà calculée pour cette question, ou None."""
+    return flask_cache.get(_decision_cache_key(model_name, user_question))
+
+def set_cached_decision(model_name, user_question, decision, timeout):
+    """Enregistre une décision de routage pour `timeout` secondes."""
+    flask_cache.set(_decision_cache_key(model_name, user_question), decision, timeout=timeout)
+
+def get_cached_search_results(query):
+    """Récupère les résultats SearXNG déjà obtenus pour cette requête, ou None."""
+    return flask_cache.get(_hashed_key(SEARCH_CACHE_PREFIX, _normalize_text_key(query)))
+
+def set_cached_search_results(query, results, timeout):
+    """Enregistre les résultats SearXNG d'une requête pour `timeout` secondes."""
+    flask_cache.set(_hashed_key(SEARCH_CACHE_PREFIX, _normalize_text_key(query)), results, timeout=timeout)
+
+def claim_orchestration(payload, task_id, timeout):
+    """
+    Réserve `task_id` pour cette conversation pendant `timeout` secondes.
+    Retourne None si la réservation réussit, sinon l'identifiant de la tâche déjà soumise pour la même conversation.
+    """
+    key = _hashed_key(ORCHESTRATION_CACHE_PREFIX, payload)
+    # `add` n'écrit que si la clé est absente (SETNX sur Redis) : deux soumissions simultanées ne peuvent pas réserver toutes les deux.
+    if flask_cache.add(key, task_id, timeout=timeout):
+        return None
+    return flask_cache.get(key)
+
+def release_orchestration(payload):
+    """Libère la réservation d'une conversation (tâche finalement non soumise au broker)."""
+    flask_cache.delete(_hashed_key(ORCHESTRATION_CACHE_PREFIX, payload))
+
+def get_cached_page(url):
+    """Récupère le texte déjà extrait d'une page web, ou None."""
+    return flask_cache.get(_hashed_key(PAGE_CACHE_PREFIX, url))
+
+def set_cached_page(url, text, timeout):
+    """Enregistre le texte extrait d'une page web pour `timeout` secondes."""
+    flask_cache.set(_hashed_key(PAGE_CACHE_PREFIX, url), text, timeout=timeout)
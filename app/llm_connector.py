@@ -1,28 +1,58 @@
 # app/llm_connector.py
 import openai
-import json
 import base64
 import requests
 import mimetypes
-import copy
 import time
-from typing import Dict, Optional, List, Any, Iterator
+from typing import Dict, Optional, List, Any, Iterator, Tuple
 import uuid
 
 # Third-party libraries
+import orjson
 from flask import current_app
 from openai.types.chat import ChatCompletion
 from openai.types.chat.chat_completion import Choice, ChatCompletionMessage
 
+def _inline_remote_images(messages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Remplace les images référencées par une URL web par leur encodage Base64 (data URI).
+    Copie à l'écriture : seuls les messages et les parties contenant une image distante sont recréés,
+    les autres sont partagés avec la liste d'origine, qui n'est jamais modifiée.
+    Retourne la nouvelle liste et un indicateur de requête multimodale.
+    """
+    processed_messages = []
+    is_multimodal_request = False
+
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, list):
+            new_content = None
+            for index, part in enumerate(content):
+                if part.get('type') != 'image_url':
+                    continue
+                url = part.get('image_url', {}).get('url')
+                # On encode uniquement les URL web, pas les données déjà en Base64
+                if url and url.startswith(('http://', 'https://')):
+                    is_multimodal_request = True
+                    current_app.logger.info(f"Encodage de l'image depuis l'URL : {url}")
+                    base64_uri = _encode_image_url(url)
+                    if base64_uri:
+                        if new_content is None:
+                            new_content = list(content)
+                        new_content[index] = {**part, 'image_url': {**part['image_url'], 'url': base64_uri}}
+                    else:
+                        current_app.logger.warning(f"Échec de l'encodage de l'image {url}, elle ne sera pas envoyée au LLM.")
+            if new_content is not None:
+                message = {**message, 'content': new_content}
+        processed_messages.append(message)
+
+    return processed_messages, is_multimodal_request
+
 def _get_backend_config(backend_name: str) -> Optional[Dict[str, Any]]:
     """
-    Récupère la configuration d'un backend spécifique par son nom.
+    Récupère la configuration d'un backend spécifique par son nom (index construit au démarrage par create_app).
     """
-    backends: List[Dict[str, Any]] = current_app.config.get('llm_backends', [])
-    for backend in backends:
-        if backend.get('name') == backend_name:
-            return backend
-    return None
+    return current_app.config.get('LLM_BACKENDS_BY_NAME', {}).get(backend_name)
 
 def _create_openai_client(backend_config: Dict[str, Any]) -> openai.OpenAI:
     """
@@ -84,6 +114,27 @@ def _encode_image_url(url: str) -> Optional[str]:
         current_app.logger.error(f"Impossible de récupérer l'image depuis l'URL {url}: {e}")
         return None
 
+# Découverte des modèles : un backend injoignable ne doit pas bloquer le rafraîchissement périodique.
+# Timeout court et sans nouvelle tentative (le timeout d'inférence peut atteindre plusieurs minutes),
+# puis coupe-circuit : après plusieurs échecs de connexion consécutifs, le backend n'est plus interrogé
+# pendant un moment. L'état est propre à chaque processus worker.
+_MODEL_LISTING_TIMEOUT = 10.0
+_MODEL_LISTING_MAX_FAILURES = 3
+_MODEL_LISTING_COOLDOWN = 900  # secondes
+_model_listing_failures: Dict[str, int] = {}
+_model_listing_blocked_until: Dict[str, float] = {}
+
+def _record_model_listing_failure(backend_name: str) -> None:
+    """Compte un échec de connexion et ouvre le coupe-circuit du backend au-delà du seuil."""
+    failures = _model_listing_failures.get(backend_name, 0) + 1
+    _model_listing_failures[backend_name] = failures
+    if failures >= _MODEL_LISTING_MAX_FAILURES:
+        _model_listing_blocked_until[backend_name] = time.monotonic() + _MODEL_LISTING_COOLDOWN
+        current_app.logger.warning(
+            f"Backend '{backend_name}' injoignable {failures} fois de suite : découverte des modèles suspendue "
+            f"pendant {_MODEL_LISTING_COOLDOWN}s."
+        )
+
 def list_models_from_backend(backend_config: Dict[str, Any]) -> List[Any]:
     """
     Interroge un backend pour obtenir la liste des modèles disponibles.
@@ -96,16 +147,23 @@ def list_models_from_backend(backend_config: Dict[str, Any]) -> List[Any]:
         list: Une liste d'objets de modèle (compatibles Pydantic/OpenAI) ou une liste vide en cas d'erreur.
     """
     backend_name = backend_config.get('name')
-    
+
+    if _model_listing_blocked_until.get(backend_name, 0.0) > time.monotonic():
+        current_app.logger.warning(f"Découverte des modèles ignorée pour '{backend_name}' : coupe-circuit ouvert après des échecs répétés.")
+        return []
+
     try:
         client = _create_openai_client(backend_config)
-        models_response = client.models.list()
+        models_response = client.with_options(timeout=_MODEL_LISTING_TIMEOUT, max_retries=0).models.list()
         model_list = models_response.data
         current_app.logger.info(f"{len(model_list)} modèles trouvés pour le backend '{backend_name}'.")
+        _model_listing_failures.pop(backend_name, None)
+        _model_listing_blocked_until.pop(backend_name, None)
         return model_list
 
     except (openai.APIConnectionError, openai.APITimeoutError) as e:
         current_app.logger.warning(f"Impossible de joindre le backend '{backend_name}': {e}")
+        _record_model_listing_failure(backend_name)
     except openai.APIStatusError as e:
         current_app.logger.error(f"Erreur API du backend '{backend_name}'. Statut: {e.status_code}, Réponse: {e.response.text}")
     except ValueError as e:
@@ -117,19 +175,26 @@ def list_models_from_backend(backend_config: Dict[str, Any]) -> List[Any]:
 
 # --- Fonction principale du connecteur ---
 
-def get_llm_completion(prompt: str, model_name: str, json_mode: bool = False) -> str:
+def get_llm_completion(prompt: str, model_name: str, json_mode: bool = False, response_format: Optional[Dict[str, Any]] = None,
+                       system_prompt: Optional[str] = None) -> str:
     """
     Wrapper simple pour get_chat_completion pour les cas d'utilisation non-chat.
     Appelle le LLM spécifié pour obtenir une complétion.
+    `response_format` (ex: un schéma JSON) remplace le format JSON générique demandé par `json_mode`.
+    `system_prompt`, s'il est fourni, est envoyé dans un message système distinct : un préfixe identique d'un appel
+    à l'autre peut alors être réutilisé par le cache de préfixe du backend (vLLM, llama.cpp, OpenAI...).
     """
     messages = [{"role": "user", "content": prompt}]
+    if system_prompt:
+        messages.insert(0, {"role": "system", "content": system_prompt})
 
     # La logique de routage est entièrement gérée par get_chat_completion
     response = _execute_llm_request(
         model_name=model_name,
         messages=messages,
         stream=False,
-        json_mode=json_mode
+        json_mode=json_mode,
+        response_format=response_format
     )
 
     if response and response.choices and response.choices[0].message and response.choices[0].message.content:
@@ -164,10 +229,15 @@ def get_chat_completion(
     sid = str(uuid.uuid4())
     current_app.logger.info(f"Lancement du pipeline de l'agent pour la requête API (SID: {sid}).")
 
-    # Lancer la tâche d'orchestration et attendre son résultat final (appel bloquant).
     # On passe la liste complète des messages pour préserver l'historique de la conversation.
-    async_result = tasks.orchestrator_task.delay(sid=sid, conversation=messages, model_id=model_name)
-    final_answer_str = async_result.get(propagate=True)
+    if tasks._is_enabled(current_app.config.get('INLINE_SYNC_ORCHESTRATION', False)):
+        # Le serveur web attend de toute façon la réponse : exécuter l'orchestration dans la requête évite
+        # l'aller-retour par le broker, la sérialisation des messages et l'attente sur le backend de résultats.
+        final_answer_str = tasks.orchestrator_task(sid=sid, conversation=messages, model_id=model_name)
+    else:
+        # Lancer la tâche d'orchestration et attendre son résultat final (appel bloquant).
+        async_result = tasks.submit_orchestration(sid=sid, conversation=messages, model_id=model_name)
+        final_answer_str = async_result.get(propagate=True)
 
     # Construire un objet de réponse ChatCompletion standard.
     return ChatCompletion(
@@ -190,7 +260,8 @@ def _execute_llm_request(
     backend_name: Optional[str] = None, 
     tools: Optional[List[Dict[str, Any]]] = None, 
     tool_choice: Optional[Any] = None, 
-    tried_backends: Optional[set] = None
+    tried_backends: Optional[set] = None,
+    response_format: Optional[Dict[str, Any]] = None
 ) -> Optional[Iterator[Any]]:
     """
     Effectue une requête de complétion de chat vers un backend LLM spécifique
@@ -205,6 +276,8 @@ def _execute_llm_request(
         tools (list, optional): Une liste d'outils que le modèle peut appeler.
         tool_choice (str or dict, optional): Contrôle quel outil est appelé par le modèle.
         tried_backends (set, optional): Un ensemble de noms de backends déjà essayés pour cette requête (utilisé pour le failover).
+        response_format (dict, optional): Format de réponse explicite (ex: {"type": "json_schema", ...}) pour un
+            décodage contraint. Implique le mode JSON et a priorité sur le format générique de `json_mode`.
 
     Returns:
         Un objet de complétion ou un itérateur
@@ -215,6 +288,8 @@ def _execute_llm_request(
         openai.APIError: Si l'appel à l'API échoue.
     """
     config = current_app.config
+    if response_format:
+        json_mode = True
     
     # Initialiser l'ensemble des backends essayés pour le failover
     if tried_backends is None:
@@ -250,29 +325,12 @@ def _execute_llm_request(
         raise ValueError(f"Backend '{final_backend_name}' non trouvé dans la configuration.")
 
     # 3. Traiter les messages pour la multimodalité (encodage d'images pour Ollama)
-    # On travaille sur une copie pour ne pas altérer l'objet original
-    processed_messages = copy.deepcopy(messages)
-    is_multimodal_request = False
-
-    for message in processed_messages:
-        if isinstance(message.get('content'), list):
-            for part in message['content']:
-                if part.get('type') == 'image_url':
-                    image_url_obj = part.get('image_url', {})
-                    url = image_url_obj.get('url')
-                    # On encode uniquement les URL web, pas les données déjà en Base64
-                    if url and url.startswith(('http://', 'https://')):
-                        is_multimodal_request = True
-                        current_app.logger.info(f"Encodage de l'image depuis l'URL : {url}")
-                        base64_uri = _encode_image_url(url)
-                        if base64_uri:
-                            image_url_obj['url'] = base64_uri
-                        else:
-                            current_app.logger.warning(f"Échec de l'encodage de l'image {url}, elle ne sera pas envoyée au LLM.")
+    processed_messages, is_multimodal_request = _inline_remote_images(messages)
 
     if is_multimodal_request and json_mode:
         current_app.logger.warning("Le mode JSON est désactivé pour les requêtes multimodales car il est souvent non supporté.")
         json_mode = False
+        response_format = None
 
     try: # Bloc principal pour la tentative de connexion et l'appel API
         client = _create_openai_client(backend_config)
@@ -283,7 +341,7 @@ def _execute_llm_request(
 
         if json_mode:
             # Pour la compatibilité avec OpenAI, on utilise response_format
-            params["response_format"] = {"type": "json_object"}
+            params["response_format"] = response_format or {"type": "json_object"}
 
         if tools:
             params["tools"] = tools
@@ -303,14 +361,12 @@ def _execute_llm_request(
                     # Si le contenu est une chaîne, on tente de l'analyser comme du JSON pour normaliser la réponse.
                     if isinstance(content_to_parse, str):
                         current_app.logger.debug("Tentative de normalisation de la réponse JSON du backend.")
-                        response.choices[0].message.content = json.loads(content_to_parse)
-            except (json.JSONDecodeError, IndexError, AttributeError) as e:
-                current_app.logger.error(
-                    f"Échec de la normalisation de la réponse JSON du backend. "
-                    f"La réponse n'est peut-être pas un JSON valide ou a une structure inattendue. Erreur: {e}\n"
-                    f"Contenu brut: {content_to_parse}"
-                )
-                # On ne lève pas d'exception, on retourne la réponse brute pour que l'appelant puisse la gérer.
+                        response.choices[0].message.content = orjson.loads(content_to_parse)
+            except (orjson.JSONDecodeError, IndexError, AttributeError) as e:
+                # Cas fréquent et récupérable (JSON entouré d'un bloc markdown ou d'une phrase) : l'appelant
+                # analyse lui-même le texte brut. Le contenu complet n'est journalisé qu'en mode debug.
+                current_app.logger.warning(f"Réponse JSON du backend non normalisée, transmise brute à l'appelant : {e}")
+                current_app.logger.debug(f"Contenu brut: {content_to_parse}")
 
         return response
     except (openai.APIConnectionError, openai.APITimeoutError) as e:
@@ -334,7 +390,7 @@ def _execute_llm_request(
             return _execute_llm_request( # Correction: appel récursif à soi-même pour le failover
                 model_name=model_name, messages=messages, stream=stream, json_mode=json_mode,
                 backend_name=next_backend_name, tools=tools, tool_choice=tool_choice,
-                tried_backends=tried_backends
+                tried_backends=tried_backends, response_format=response_format
             )
         else:
             # Si tous les backends ont été essayés et ont échoué
@@ -4,12 +4,13 @@ from celery.result import AsyncResult
 from app.extensions import celery, limiter # Import de l'instance Celery et du limiteur
 from .extensions import _get_key_info_from_request
 import json
+import time
 import uuid
 
 from .auth import require_api_key
 from .cache import get_models_from_cache
 from . import llm_connector
-from .tasks import orchestrator_task
+from .tasks import submit_orchestration
 
 # Configuration du logger
 logger = logging.getLogger(__name__)
@@ -118,7 +119,7 @@ def chat_completions():
         logger.info(f"Flux asynchrone détecté pour SID {sid}. Lancement de la tâche en arrière-plan.")
         # Récupérer les informations de l'utilisateur pour les passer à la tâche
         user_info = _get_key_info_from_request()
-        task = orchestrator_task.delay(sid=sid, conversation=conversation, model_id=model_id, user_info=user_info)
+        task = submit_orchestration(sid=sid, conversation=conversation, model_id=model_id, user_info=user_info, stream_tokens=True)
         
         response_payload = {
             "id": task.id,
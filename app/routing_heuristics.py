@@ -0,0 +1,69 @@
+# app/routing_heuristics.py
+"""
+Heuristiques locales de routage.
+
+Certaines questions n'ont pas besoin du LLM de routage pour être aiguillées : une salutation,
+un remerciement ou un calcul se traitent directement, une URL fournie par l'utilisateur doit être lue.
+Ces règles s'évaluent en quelques microsecondes et évitent un aller-retour complet vers le LLM.
+Les constantes sont regroupées ici pour pouvoir être ajustées sans toucher à l'orchestrateur.
+"""
+import re
+from typing import Any, Dict, Iterable, Optional
+
+# Messages de politesse isolés : aucune information externe n'est nécessaire.
+DIRECT_RESPONSE_RE = re.compile(
+    r"^\s*(?:bonjour|bonsoir|salut|coucou|hello|hi|hey|allo|"
+    r"merci(?: beaucoup| bien)?|thanks?(?: you)?|ok(?:ay)?|d'accord|parfait|super|"
+    r"au revoir|bye|bonne (?:nuit|journée|soirée)|"
+    r"qui es[- ]tu|qui êtes[- ]vous|tu es qui|who are you)"
+    r"[\s!.,?]*$",
+    re.IGNORECASE,
+)
+
+# Expressions purement arithmétiques (ex: "12 * (3 + 4) ?") : au moins un opérateur entre deux opérandes.
+# Appliquée à la question sans ses blancs, pour que chaque caractère ne puisse être consommé que d'une façon.
+_OPERAND = r"\(*-?\d+(?:[.,]\d+)?\)*"
+ARITHMETIC_RE = re.compile(rf"^{_OPERAND}(?:[+\-*/^%×÷]{_OPERAND})+=?\??$")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Nombres séparés par "-" ou "/" sans espaces : dates, intervalles ou numéros de téléphone (ex: "12/05/2024",
+# "2024-2025", "514-555-1234"), et non des calculs.
+NUMBER_SEQUENCE_RE = re.compile(r"^\s*\d+(?:[-/]\d+)+\s*(?:\?\s*)?$")
+
+# URLs fournies explicitement par l'utilisateur : on les lit plutôt que de demander au routeur.
+URL_RE = re.compile(r"https?://[^\s<>\"'`)\]]+", re.IGNORECASE)
+
+# Termes qui impliquent une information récente. La météo n'en fait pas partie : un outil dédié
+# existe et c'est au routeur de le choisir avec ses paramètres (lieu, etc.). "Aujourd'hui" seul non plus :
+# il accompagne surtout des questions de météo ou de date, que la synthèse traite avec le contexte temporel.
+SEARCH_TRIGGER_RE = re.compile(r"\b(?:actualités?|prix|cours de (?:la |l')?bourse)\b", re.IGNORECASE)
+
+
+def _is_arithmetic(question: str) -> bool:
+    """Indique si la question est un calcul, et non une date ou un numéro formé de nombres et de tirets."""
+    return bool(ARITHMETIC_RE.match(_WHITESPACE_RE.sub("", question))) and not NUMBER_SEQUENCE_RE.match(question)
+
+
+def fast_route(user_question: str, available_tool_names: Iterable[str]) -> Optional[Dict[str, Any]]:
+    """
+    Retourne une décision de routage si la question peut être aiguillée sans LLM, sinon None.
+    Les décisions produites ont la même forme que celles du LLM de routage.
+    """
+    question = user_question.strip()
+    if not question:
+        return None
+
+    if DIRECT_RESPONSE_RE.match(question) or _is_arithmetic(question):
+        return {"action": "respond_directly"}
+
+    available_tool_names = set(available_tool_names)
+
+    if "read_webpage" in available_tool_names and (urls := URL_RE.findall(question)):
+        # Conserve l'ordre d'apparition en retirant les doublons et la ponctuation finale.
+        urls = list(dict.fromkeys(url.rstrip(".,;:!?") for url in urls))
+        return {"action": "call_tool", "tool_name": "read_webpage", "parameters": {"url": urls}}
+
+    if "search_web" in available_tool_names and SEARCH_TRIGGER_RE.search(question):
+        return {"action": "call_tool", "tool_name": "search_web", "parameters": {"query": question}}
+
+    return None
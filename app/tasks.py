@@ -1,128 +1,347 @@
 import eventlet # OLD_CODE_FOR_REMOVAL: Added to fix NameError
+import atexit
 import logging
-import json
+import codecs
+import html
+import http.cookiejar
+import math
 import os
-import copy
+import functools
+import re
+import time
+import uuid
 from datetime import datetime
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import urllib.parse
 import unicodedata
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import openai
+import orjson
+from lxml import etree, html as lxml_html
+from selectolax.lexbor import LexborHTMLParser
 from flask import current_app
+from celery import group
 from eventlet.greenpool import GreenPool
+from celery.result import AsyncResult
 from app.extensions import socketio, celery
 from app.llm_connector import get_llm_completion, _execute_llm_request, _get_backend_config
 from app.services import refresh_and_cache_models 
+from app.tools_definitions import ToolSpec
+from app.routing_heuristics import fast_route
+from app.cache import (
+    get_cached_decision, set_cached_decision,
+    get_cached_search_results, set_cached_search_results,
+    get_cached_page, set_cached_page,
+    claim_orchestration, release_orchestration,
+)
 
 # Configuration du logger
 logger = logging.getLogger(__name__)
 
+# Session HTTP partagée par le processus worker pour SearXNG et la lecture des pages : les connexions
+# (TCP + TLS) sont conservées et réutilisées d'une requête à l'autre au lieu d'être rouvertes à chaque appel.
+# `pool_maxsize` couvre les lectures de pages lancées en parallèle par les green threads vers un même hôte.
+# Les erreurs transitoires (connexion, passerelle 502/503/504) sont réessayées deux fois avec un court délai ;
+# une fois les tentatives épuisées, la dernière réponse est rendue pour que `raise_for_status` la traite.
+# Une lecture trop lente n'est pas réessayée : elle aurait déjà consommé tout son délai.
+_HTTP_RETRY = Retry(total=2, connect=2, read=0, backoff_factor=0.2, status_forcelist=[502, 503, 504], raise_on_status=False)
+# Délais (connexion, lecture) en secondes : un hôte injoignable échoue vite sans écourter la lecture d'une page lente.
+_SEARCH_TIMEOUT = (3, 8)
+_PAGE_TIMEOUT = (3, 12)
+# Identifie le scraper auprès des sites lus ; SearXNG et les API d'outils reçoivent l'agent par défaut de requests.
+_SCRAPER_HEADERS = {'User-Agent': 'Harpou-AI-Gateway-Scraper/1.0'}
+_HTTP = requests.Session()
+# La session est partagée par tous les utilisateurs et tous les sites : aucun cookie n'est conservé,
+# sinon un `Set-Cookie` reçu pour un utilisateur serait renvoyé pour les suivants et le jar grossirait sans limite.
+_HTTP.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+_HTTP.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=_HTTP_RETRY))
+_HTTP.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=_HTTP_RETRY))
+# Ferme proprement les connexions conservées à l'arrêt du worker.
+atexit.register(_HTTP.close)
+
+# Contenu des fichiers de prompt déjà lus, par chemin : (date de modification, contenu).
+# Les prompts changent rarement : un simple `stat` suffit ensuite à vérifier qu'ils sont à jour.
+_prompt_cache: Dict[str, Tuple[float, str]] = {}
+
 def _get_prompt_from_file(filename: str) -> Optional[str]:
-    """Lit un prompt depuis un fichier dans le dossier config/prompts."""
+    """Lit un prompt depuis un fichier dans le dossier config/prompts (relu seulement s'il a été modifié)."""
     if not filename:
         return None
     try:
         # Le chemin racine du projet est un niveau au-dessus du répertoire de l'application
         project_root = os.path.abspath(os.path.join(current_app.root_path, os.pardir))
         prompt_path = os.path.join(project_root, 'config', 'prompts', filename)
-        
-        if os.path.exists(prompt_path):
-            with open(prompt_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        else:
-            logger.warning(f"Le fichier de prompt '{filename}' est configuré mais n'a pas été trouvé à l'emplacement : {prompt_path}")
+
+        try:
+            mtime = os.stat(prompt_path).st_mtime
+        except FileNotFoundError:
+            _prompt_cache.pop(prompt_path, None)
+            logger.warning("Le fichier de prompt '%s' est configuré mais n'a pas été trouvé à l'emplacement : %s", filename, prompt_path)
             return None
+
+        cached = _prompt_cache.get(prompt_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(prompt_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        _prompt_cache[prompt_path] = (mtime, content)
+        return content
     except Exception as e:
-        logger.error(f"Erreur lors de la lecture du fichier de prompt '{filename}': {e}")
+        logger.error("Erreur lors de la lecture du fichier de prompt '%s': %s", filename, e)
         return None
 
+def _is_enabled(value: Any) -> bool:
+    """Interprète une option booléenne, qu'elle vienne de config.json (bool) ou d'une variable d'environnement (chaîne)."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 't', 'yes')
+    return bool(value)
+
+def _config_int(key: str, default: int) -> int:
+    """Lit une option entière de la configuration, en tolérant les chaînes issues des variables d'environnement."""
+    try:
+        return int(current_app.config.get(key, default))
+    except (TypeError, ValueError):
+        logger.warning("Valeur invalide pour '%s'. Utilisation de la valeur par défaut : %s.", key, default)
+        return default
+
 def _normalize_string(s: str) -> str:
     """Retire les accents et autres diacritiques d'une chaîne de caractères."""
     if not isinstance(s, str):
         return str(s)
     return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
 
-def get_llm_decision(user_question: str, model_name: str):
+def _parse_llm_json(text: str) -> Any:
     """
-    Appelle le LLM pour déterminer si une question nécessite un outil ou une réponse directe,
-    en utilisant la liste d'outils chargée depuis la configuration de l'application.
+    Analyse la réponse JSON d'un LLM. Les backends sans décodage contraint l'entourent parfois d'un bloc
+    markdown (```json ... ```) ou d'une phrase : en cas d'échec, on retente sur le texte compris entre
+    la première accolade ouvrante et la dernière accolade fermante.
     """
-    logger.info(f"Demande de décision au LLM pour : {user_question!r}")
-    available_tools = current_app.config.get('AVAILABLE_TOOLS', [])
-
-    # Générer dynamiquement les exemples de sortie JSON pour chaque outil
-    tool_examples = []
-    for tool in available_tools:
-        tool_name = tool.get("name")
-        params = tool.get("parameters", {}).get("properties", {})
-        example_params = {p_name: f"valeur pour {p_name}" for p_name in params}
-        example_json = {"action": "call_tool", "tool_name": tool_name, "parameters": example_params}
-        tool_examples.append(f"- Pour utiliser l'outil '{tool_name}': {json.dumps(example_json)}")
-
-    tool_examples.append('- Pour une réponse directe : {"action": "respond_directly"}')
-    examples_str = "\n".join(tool_examples)
-
-    # Charger le template du prompt de routage depuis un fichier
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return orjson.loads(text[start:end + 1])
+
+@functools.lru_cache(maxsize=8)
+def _render_routing_prompt(template: str, available_tools_json: str, examples_str: str) -> str:
+    """Remplit le template du prompt de routage. Mis en cache : les entrées ne changent qu'au rechargement de la configuration."""
+    return template.format(available_tools=available_tools_json, examples_str=examples_str)
+
+# Prompt de routage utilisé si le fichier configuré (`routing_prompt_file`) est manquant ou vide.
+_DEFAULT_ROUTING_PROMPT_TEMPLATE = """Vous êtes un orchestrateur. Choisissez une action: `call_tool` ou `respond_directly`. Outils: {available_tools}. Répondez en JSON comme dans ces exemples: {examples_str}."""
+
+def _load_routing_prompt_template() -> str:
+    """Retourne le template du prompt de routage configuré par l'opérateur (ou le template par défaut)."""
     routing_prompt_file = current_app.config.get("routing_prompt_file", "default_routing.txt")
     system_prompt_template = _get_prompt_from_file(routing_prompt_file)
-
     if not system_prompt_template:
-        # Fallback vers un prompt hardcodé si le fichier est manquant ou vide
         logger.error("Le template du prompt de routage est manquant ou vide. Utilisation d'un prompt par défaut.")
-        system_prompt_template = """Vous êtes un orchestrateur. Choisissez une action: `call_tool` ou `respond_directly`. Outils: {available_tools}. Répondez en JSON comme dans ces exemples: {examples_str}."""
+        return _DEFAULT_ROUTING_PROMPT_TEMPLATE
+    return system_prompt_template
+
+# Routage par appel d'outils natif : le prompt de l'opérateur est conservé, mais la liste des outils est
+# transmise via le paramètre `tools` de l'API et les exemples JSON sont remplacés par la consigne d'appel.
+_NATIVE_ROUTING_TOOLS_PLACEHOLDER = "(fournis via l'appel d'outils natif : utilisez-les EXACTEMENT sous leur nom)"
+_NATIVE_ROUTING_INSTRUCTION = (
+    "- Pour utiliser un outil : appelez-le directement via l'appel d'outils natif, sans écrire de JSON.\n"
+    "- Pour une réponse directe : n'appelez aucun outil."
+)
+# Consigne ajoutée lorsque la réponse directe du routeur peut être servie telle quelle à l'utilisateur.
+_NATIVE_ROUTING_ANSWER_INSTRUCTION = " Dans ce cas, répondez directement et complètement à la question."
+
+# Modèles ayant signalé qu'ils ne supportent pas l'appel d'outils natif (mémorisé par processus worker).
+_MODELS_WITHOUT_NATIVE_TOOLS = set()
+# Modèles dont le backend refuse le décodage contraint par schéma JSON (mémorisé par processus worker).
+_MODELS_WITHOUT_JSON_SCHEMA = set()
+
+def _get_native_tool_decision(user_question: str, model_name: str, allow_answer: bool = False) -> Dict[str, Any]:
+    """
+    Obtient la décision de routage via l'appel d'outils natif (function calling) du backend.
+    Aucune analyse de texte n'est nécessaire : le modèle retourne directement un appel structuré.
+    Si `allow_answer` est vrai, le texte produit sans appel d'outil est conservé dans le champ 'answer'.
+    """
+    instruction = _NATIVE_ROUTING_INSTRUCTION
+    if allow_answer:
+        instruction += _NATIVE_ROUTING_ANSWER_INSTRUCTION
+    system_prompt = _render_routing_prompt(_load_routing_prompt_template(), _NATIVE_ROUTING_TOOLS_PLACEHOLDER, instruction)
+    response = _execute_llm_request(
+        model_name=model_name,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_question},
+        ],
+        stream=False,
+        tools=current_app.config.get('AVAILABLE_TOOLS_OPENAI', []),
+        tool_choice="auto"
+    )
+    message = response.choices[0].message
+    if not message.tool_calls:
+        # Le prompt de l'opérateur demande une réponse JSON : certains modèles s'y conforment plutôt que d'appeler l'outil.
+        if message.content and '"action"' in message.content:
+            try:
+                decision = _parse_llm_json(message.content)
+            except orjson.JSONDecodeError:
+                decision = None
+            if isinstance(decision, dict) and decision.get("action"):
+                if not allow_answer:
+                    decision.pop("answer", None)
+                return decision
+        if allow_answer and message.content:
+            return {"action": "respond_directly", "answer": message.content}
+        return {"action": "respond_directly"}
+
+    function_call = message.tool_calls[0].function
+    arguments = function_call.arguments
+    return {
+        "action": "call_tool",
+        "tool_name": function_call.name,
+        "parameters": orjson.loads(arguments) if isinstance(arguments, (str, bytes)) and arguments else (arguments or {})
+    }
+
+# Questions dont la réponse dépend du moment : on ne réutilise pas une décision déjà calculée.
+_TIME_SENSITIVE_RE = re.compile(
+    r"\b(aujourd'hui|maintenant|ce soir|live|demain|hier|cette semaine|en ce moment|"
+    r"m[ée]t[ée]o|actualit[ée]s?|news|prix|cours)\b",
+    re.IGNORECASE,
+)
+
+def _is_cacheable_decision(decision: Any) -> bool:
+    """
+    Indique si une décision de routage peut être réutilisée : réponse directe, ou appel d'un outil connu
+    avec des paramètres. Une réponse erronée du LLM ne doit pas être rejouée pendant toute la durée du cache.
+    """
+    if not isinstance(decision, dict):
+        return False
+    action = decision.get("action")
+    if action == "respond_directly":
+        return True
+    return (action == "call_tool"
+            and decision.get("tool_name") in current_app.config.get('TOOLS_BY_NAME', {})
+            and isinstance(decision.get("parameters"), dict))
+
+def get_llm_decision(user_question: str, model_name: str, allow_answer: bool = False):
+    """
+    Retourne la décision de routage pour une question, en réutilisant une décision récente
+    pour la même question et le même modèle afin d'éviter un aller-retour complet vers le LLM.
+    Avec `allow_answer`, une décision 'respond_directly' fraîchement calculée peut contenir la réponse
+    complète dans le champ 'answer' ; cette réponse n'est jamais mise en cache.
+    """
+    cache_ttl = _config_int('ROUTING_DECISION_CACHE_TTL', 300)
+    use_cache = cache_ttl > 0 and not _TIME_SENSITIVE_RE.search(user_question)
+
+    if use_cache:
+        cached_decision = get_cached_decision(model_name, user_question)
+        if cached_decision is not None:
+            logger.info("Décision de routage servie depuis le cache pour : %r", user_question)
+            return cached_decision
+
+    decision = _request_llm_decision(user_question, model_name, allow_answer=allow_answer)
+    if use_cache and _is_cacheable_decision(decision):
+        cacheable_decision = {k: v for k, v in decision.items() if k != "answer"}
+        set_cached_decision(model_name, user_question, cacheable_decision, timeout=cache_ttl)
+    return decision
+
+def _request_llm_decision(user_question: str, model_name: str, allow_answer: bool = False):
+    """
+    Appelle le LLM pour déterminer si une question nécessite un outil ou une réponse directe,
+    en utilisant la liste d'outils chargée depuis la configuration de l'application.
+    Utilise l'appel d'outils natif du backend lorsqu'il est disponible, sinon un prompt en mode JSON.
+    """
+    config = current_app.config
+    logger.info("Demande de décision au LLM pour : %r", user_question)
 
-    # Remplir les placeholders dans le template
-    system_prompt = system_prompt_template.format(
-        available_tools=json.dumps(available_tools, indent=2),
-        examples_str=examples_str
+    if _is_enabled(config.get('ROUTING_NATIVE_TOOLS', True)) and model_name not in _MODELS_WITHOUT_NATIVE_TOOLS:
+        try:
+            decision = _get_native_tool_decision(user_question, model_name, allow_answer=allow_answer)
+            logger.info("Décision du LLM reçue (appel d'outils natif) : %s", decision)
+            return decision
+        except openai.APIStatusError as e:
+            # Le backend refuse le paramètre `tools` : on mémorise le modèle et on bascule sur le mode JSON.
+            # Les autres refus (contexte trop long, contenu invalide...) ne concernent que cette requête.
+            error_text = str(e).lower()
+            if "does not support tools" in error_text or (isinstance(e, openai.BadRequestError) and "tool" in error_text):
+                _MODELS_WITHOUT_NATIVE_TOOLS.add(model_name)
+            logger.warning("Appel d'outils natif indisponible pour '%s' (%s). Repli sur le routage en mode JSON.", model_name, e)
+        except (orjson.JSONDecodeError, AttributeError, IndexError) as e:
+            logger.warning("Appel d'outil natif inexploitable pour '%s' (%s). Repli sur le routage en mode JSON.", model_name, e)
+
+    # Les exemples et la sérialisation JSON des outils sont pré-calculés au démarrage (voir tools_definitions).
+    tool_examples = config.get('ROUTING_TOOL_EXAMPLES', [])
+    if allow_answer:
+        direct_example = '- Pour une réponse directe : {"action": "respond_directly", "answer": "votre réponse complète à la question"}'
+    else:
+        direct_example = '- Pour une réponse directe : {"action": "respond_directly"}'
+    examples_str = "\n".join(tool_examples + [direct_example])
+
+    system_prompt = _render_routing_prompt(
+        _load_routing_prompt_template(),
+        config.get('AVAILABLE_TOOLS_JSON', '[]'),
+        examples_str
     )
-    
-    full_prompt = f"{system_prompt}\n\nQuestion utilisateur : \"{user_question}\"\n\nVotre réponse JSON :"
+
+    # Le prompt système (outils, exemples) ne dépend pas de la question : il est envoyé dans un message système
+    # séparé pour rester un préfixe identique d'une requête à l'autre, réutilisable par le cache du backend.
+    user_prompt = f"Question utilisateur : \"{user_question}\"\n\nVotre réponse JSON :"
+
+    # Décodage contraint : le backend ne peut générer qu'une décision conforme au schéma (action et outil connus).
+    response_format = None
+    decision_schema = config.get('ROUTING_DECISION_SCHEMA')
+    if (decision_schema and model_name not in _MODELS_WITHOUT_JSON_SCHEMA
+            and _is_enabled(config.get('ROUTING_JSON_SCHEMA', True))):
+        response_format = {"type": "json_schema", "json_schema": decision_schema}
 
     try:
         # On appelle le LLM en mode JSON pour garantir une sortie structurée
-        llm_response = get_llm_completion(full_prompt, model_name=model_name, json_mode=True)
+        try:
+            llm_response = get_llm_completion(user_prompt, model_name=model_name, json_mode=True, response_format=response_format,
+                                              system_prompt=system_prompt)
+        except openai.BadRequestError as e:
+            if response_format is None:
+                raise
+            # Le backend ne connaît pas `json_schema` : on mémorise le modèle et on se contente du mode JSON simple.
+            _MODELS_WITHOUT_JSON_SCHEMA.add(model_name)
+            logger.warning("Décodage par schéma JSON refusé pour '%s' (%s). Repli sur le mode JSON simple.", model_name, e)
+            llm_response = get_llm_completion(user_prompt, model_name=model_name, json_mode=True, system_prompt=system_prompt)
         
         if isinstance(llm_response, str):
-            decision = json.loads(llm_response)
+            decision = _parse_llm_json(llm_response)
         elif isinstance(llm_response, dict):
             decision = llm_response
         else:
             raise TypeError(f"Type de réponse inattendu du LLM : {type(llm_response)}")
-        logger.info(f"Décision du LLM reçue : {decision}")
+        logger.info("Décision du LLM reçue : %s", decision)
         return decision
     except Exception as e:
-        logger.error(f"Échec de l'obtention ou de l'analyse de la décision du LLM : {e}", exc_info=True)
+        logger.error("Échec de l'obtention ou de l'analyse de la décision du LLM : %s", e, exc_info=True)
         # Il est crucial de relancer l'exception pour que la tâche Celery soit marquée comme FAILED.
         raise
 
+# Actions propres au planificateur, ajoutées après les exemples d'appel d'outil.
+_PLANNER_ACTION_EXAMPLES = (
+    '- Pour une réponse directe à l\'utilisateur: {"action": "respond_directly", "answer": "Votre réponse ici"}',
+    '- Pour synthétiser une réponse basée sur les informations collectées: {"action": "synthesize_answer", "summary": "Résumé des informations collectées"}',
+    '- Pour continuer la boucle de raisonnement en arrière-plan (si le budget le permet): {"action": "continue_in_background"}',
+)
+
 def get_planner_decision(conversation_history: List[Dict[str, Any]], model_name: str, budget_context: Dict[str, Any]):
     """
     Appelle le LLM pour déterminer la prochaine étape dans la boucle de raisonnement (planification).
     Prend en compte l'historique de la conversation et le budget restant.
     """
-    logger.info(f"Demande de décision au planificateur pour SID: {conversation_history[0].get('sid', 'N/A')}")
-
-    available_tools = current_app.config.get('AVAILABLE_TOOLS', [])
+    logger.info("Demande de décision au planificateur pour SID: %s", conversation_history[0].get('sid', 'N/A'))
 
-    # Générer dynamiquement les exemples de sortie JSON pour chaque outil
-    tool_examples = []
-    for tool in available_tools:
-        tool_name = tool.get("name")
-        params = tool.get("parameters", {}).get("properties", {})
-        example_params = {p_name: f"valeur pour {p_name}" for p_name in params}
-        example_json = {"action": "call_tool", "tool_name": tool_name, "parameters": example_params}
-        tool_examples.append(f"- Pour utiliser l'outil '{tool_name}': {json.dumps(example_json)}")
+    config = current_app.config
 
-    tool_examples.append('- Pour une réponse directe à l\'utilisateur: {"action": "respond_directly", "answer": "Votre réponse ici"}')
-    tool_examples.append('- Pour synthétiser une réponse basée sur les informations collectées: {"action": "synthesize_answer", "summary": "Résumé des informations collectées"}')
-    tool_examples.append('- Pour continuer la boucle de raisonnement en arrière-plan (si le budget le permet): {"action": "continue_in_background"}')
-    examples_str = "\n".join(tool_examples)
+    # Les exemples par outil et le JSON des outils sont pré-calculés au démarrage (voir tools_definitions._initialize_tools).
+    examples_str = "\n".join([*config.get('ROUTING_TOOL_EXAMPLES', []), *_PLANNER_ACTION_EXAMPLES])
 
     # Charger le template du prompt du planificateur depuis un fichier
-    planner_prompt_file = current_app.config.get("planner_prompt_file", "default_planner.txt") # Assurez-vous que ce fichier existe
+    planner_prompt_file = config.get("planner_prompt_file", "default_planner.txt") # Assurez-vous que ce fichier existe
     system_prompt_template = _get_prompt_from_file(planner_prompt_file)
 
     if not system_prompt_template:
@@ -135,232 +354,405 @@ Contexte du budget: {budget_context}.
 Historique de la conversation: {conversation_history}
 Votre réponse JSON:"""
 
-    # Remplir les placeholders dans le template
+    # Remplir les placeholders dans le template. L'historique complet est resérialisé à chaque étape : orjson le fait
+    # bien plus vite que le module json et conserve les accents tels quels.
     system_prompt = system_prompt_template.format(
-        available_tools=json.dumps(available_tools, indent=2),
+        available_tools=config.get('AVAILABLE_TOOLS_JSON', '[]'),
         examples_str=examples_str,
-        budget_context=json.dumps(budget_context, indent=2),
-        conversation_history=json.dumps(conversation_history, indent=2)
+        budget_context=orjson.dumps(budget_context, option=orjson.OPT_INDENT_2).decode(),
+        conversation_history=orjson.dumps(conversation_history, option=orjson.OPT_INDENT_2).decode()
     )
 
     try:
         llm_response = get_llm_completion(system_prompt, model_name=model_name, json_mode=True)
 
         if isinstance(llm_response, str):
-            decision = json.loads(llm_response)
+            decision = _parse_llm_json(llm_response)
         elif isinstance(llm_response, dict):
             decision = llm_response
         else:
             raise TypeError(f"Type de réponse inattendu du LLM : {type(llm_response)}")
-        logger.info(f"Décision du planificateur reçue : {decision}")
+        logger.info("Décision du planificateur reçue : %s", decision)
         return decision
     except Exception as e:
-        logger.error(f"Échec de l'obtention ou de l'analyse de la décision du planificateur : {e}", exc_info=True)
+        logger.error("Échec de l'obtention ou de l'analyse de la décision du planificateur : %s", e, exc_info=True)
         raise
 
 
-def _execute_tool(tool_name: str, parameters: dict, user_question: str) -> str:
+# Nombre minimal de mots d'une question pour lancer une recherche spéculative.
+_SPECULATIVE_SEARCH_MIN_WORDS = 3
+
+def _is_same_search_query(query: str, user_question: str) -> bool:
+    """Indique si la requête choisie par le routeur est la question de l'utilisateur, à la casse, aux accents et aux espaces près."""
+    if not isinstance(query, str):
+        return False
+    return _normalize_string(query).casefold().split() == _normalize_string(user_question).casefold().split()
+
+# Résultats dont la lecture ne produirait pas de texte exploitable : fichiers binaires, et sites dont
+# les pages sont rendues en JavaScript ou réservées aux utilisateurs connectés.
+_UNREADABLE_URL_EXTENSIONS = (
+    ".pdf", ".zip", ".gz", ".tar", ".rar", ".7z", ".exe", ".dmg", ".iso",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".mp3", ".mp4", ".avi", ".mov", ".webm",
+    ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx",
+)
+_UNREADABLE_DOMAINS = (
+    "youtube.com", "youtu.be", "facebook.com", "instagram.com", "tiktok.com", "twitter.com", "x.com", "linkedin.com",
+)
+
+def _is_readable_url(url: Any) -> bool:
+    """Indique, d'après la seule forme de l'URL, si la page mérite d'être téléchargée pour en extraire le texte."""
+    if not isinstance(url, str) or not url:
+        return False
+    parsed = urllib.parse.urlsplit(url)
+    host = (parsed.hostname or "").lower()
+    if any(host == domain or host.endswith("." + domain) for domain in _UNREADABLE_DOMAINS):
+        return False
+    return not parsed.path.lower().endswith(_UNREADABLE_URL_EXTENSIONS)
+
+def _select_urls_to_read(search_results: list, count: int) -> List[str]:
+    """Retourne les `count` premières URLs lisibles des résultats, dans l'ordre du classement."""
+    urls = []
+    for res in search_results:
+        url = res.get('url')
+        if _is_readable_url(url):
+            urls.append(url)
+            if len(urls) >= count:
+                break
+    return urls
+
+def _run_search_web(tool: ToolSpec, parameters: dict, user_question: str, prefetched_search_results: Optional[list]) -> str:
+    """Recherche web, lecture en parallèle des pages principales et ajout des extraits des résultats suivants."""
+    query = parameters.get("query", "")
+    logger.info("Orchestrateur : appel de la fonction interne 'search_web' avec la requête : %s", query)
+
+    # Récupérer les paramètres configurables depuis tools_config.json, avec des valeurs par défaut.
+    pages_to_read = tool.execution_details.get("pages_to_read", 1)
+    excerpts_to_show = tool.execution_details.get("excerpts_to_show", 4)
+
+    if prefetched_search_results is not None:
+        logger.info("Orchestrateur : réutilisation des résultats de la recherche spéculative.")
+        search_results = prefetched_search_results
+    else:
+        search_results = search_web_task(query=query)
+    if not isinstance(search_results, list) or not search_results:
+        return "La recherche n'a retourné aucun résultat."
+
+    # --- Lecture en parallèle des pages principales ---
+    urls_to_read = _select_urls_to_read(search_results, pages_to_read)
+    context_parts = []
+
+    if urls_to_read:
+        read_contents = _read_webpages(urls_to_read)
+        # Seuls les passages les plus pertinents de chaque page sont transmis à la synthèse.
+        page_context_chars = _config_int('PAGE_CONTEXT_MAX_CHARS', 2000)
+        relevance_query = f"{query} {user_question}"
+
+        context_parts.append("--- CONTENU DES PAGES PRINCIPALES ---\n")
+        for i, content in enumerate(read_contents):
+            content = _select_relevant_passages(content, relevance_query, page_context_chars)
+            context_parts.append(f"Source {i+1}: {urls_to_read[i]}\nContenu:\n{content}\n---\n")
+
+    # --- Ajout des extraits des pages suivantes ---
+    read_urls = set(urls_to_read)
+    excerpt_results = [res for res in search_results if res.get('url') not in read_urls][:excerpts_to_show]
+    if excerpt_results:
+        context_parts.append("\n--- AUTRES RÉSULTATS DE RECHERCHE (EXTRAITS) ---\n")
+        context_parts.append(_format_results_as_context(excerpt_results))
+
+    return "".join(context_parts)
+
+def _run_read_webpage(tool: ToolSpec, parameters: dict, user_question: str, prefetched_search_results: Optional[list]) -> str:
+    """Lecture en parallèle d'une ou plusieurs URLs fournies par le routeur."""
+    urls = parameters.get("url", [])
+    if isinstance(urls, str):
+        # Si une seule URL est fournie, on la traite comme une liste d'un seul élément.
+        urls = [urls]
+
+    if not urls:
+        return "Erreur: Aucune URL n'a été fournie."
+
+    logger.info("Orchestrateur : appel de la fonction interne 'read_webpage' sur %s URL(s).", len(urls))
+    read_contents = _read_webpages(urls)
+    return _format_page_contents(urls, read_contents).strip()
+
+# Fonctions internes exécutables, indexées par nom d'outil.
+_INTERNAL_FUNCTIONS = {
+    "search_web": _run_search_web,
+    "read_webpage": _run_read_webpage,
+}
+
+def _run_internal_function(tool: ToolSpec, parameters: dict, user_question: str, prefetched_search_results: Optional[list]) -> str:
+    """Logique pour les fonctions internes (tâches Celery)."""
+    handler = _INTERNAL_FUNCTIONS.get(tool.name)
+    if handler is None:
+        error_msg = f"Fonction interne non implémentée: '{tool.name}'"
+        logger.warning(error_msg)
+        return error_msg
+    return handler(tool, parameters, user_question, prefetched_search_results)
+
+def _run_api_call(tool: ToolSpec, parameters: dict, user_question: str, prefetched_search_results: Optional[list]) -> str:
+    """Appel d'une API HTTP décrite dans `execution_details`."""
+    details = tool.execution_details
+    if not details:
+        return f"Erreur: 'execution_details' manquant pour l'outil API '{tool.name}'."
+
+    method = details.get("method", "GET").upper()
+    # Gère les secrets via les variables d'environnement (ex: $API_KEY)
+    headers = {k: os.path.expandvars(str(v)) for k, v in details.get("headers", {}).items()}
+
+    url_template = details.get("url_template", details.get("url", ""))
+    if "url_template" in details:
+        # URL-encode les paramètres pour gérer les espaces et caractères spéciaux de manière sécurisée.
+        encoded_params = {k: urllib.parse.quote(str(v)) for k, v in parameters.items()}
+        url = url_template.format(**encoded_params)
+    else:
+        url = details.get("url", "") # Fallback si aucun template n'est fourni
+
+    logger.info("Appel API: %s %s", method, url)
+    # Passe par la session partagée : connexions conservées vers l'API et mêmes réessais que SearXNG.
+    response = _HTTP.request(method, url, headers=headers, timeout=15)
+    response.raise_for_status()
+    return response.text
+
+def _run_search_and_read_webpage(tool: ToolSpec, parameters: dict, user_question: str, prefetched_search_results: Optional[list]) -> str:
+    """Recherche générée depuis un template, puis lecture des premières pages trouvées."""
+    logger.info("Exécution de l'outil de type 'search_and_read_webpage': '%s'", tool.name)
+    details = tool.execution_details
+    if "query_template" not in details:
+        return f"Erreur: 'execution_details' mal configuré pour l'outil '{tool.name}'. Attendu: 'query_template'."
+
+    query = details["query_template"].format(**parameters)
+    pages_to_read = details.get("pages_to_read", 1)
+
+    logger.info("Recherche générée pour '%s': %s", tool.name, query)
+    search_results = search_web_task(query=query)
+    if not isinstance(search_results, list) or not search_results:
+        return "La recherche n'a retourné aucun résultat."
+
+    urls_to_read = _select_urls_to_read(search_results, pages_to_read)
+
+    if not urls_to_read:
+        return "La recherche n'a retourné aucune URL à lire."
+
+    read_contents = _read_webpages(urls_to_read)
+    search_and_read_context = _format_page_contents(urls_to_read, read_contents)
+
+    # --- Logique d'enrichissement pour la météo ---
+    if tool.name == "get_detailed_weather":
+        supplementary_context = ""
+        keywords_to_check = ["insecte", "moustique", "pollen", "qualité de l'air", "uv", "humidex"]
+
+        keywords_found = [kw for kw in keywords_to_check if kw in user_question.lower()]
+        if keywords_found:
+            logger.info("La question météo contient des mots-clés spécifiques (%s). Lancement d'une recherche web pour enrichir les données.", keywords_found)
+
+            location = parameters.get("location", "l'endroit demandé")
+            search_terms = ", ".join(keywords_found)
+            supplementary_query = f"prévision {search_terms} pour {location}"
+
+            supplementary_search_results = search_web_task(query=supplementary_query)
+            if supplementary_search_results:
+                supplementary_context = "\n\n--- Informations complémentaires (recherche web) ---\n"
+                supplementary_context += _format_results_as_context(supplementary_search_results[:3])
+        return f"{search_and_read_context}{supplementary_context}"
+
+    return search_and_read_context.strip()
+
+def _run_url_from_template(tool: ToolSpec, parameters: dict, user_question: str, prefetched_search_results: Optional[list]) -> str:
+    """Lecture directe d'une URL construite depuis un template."""
+    logger.info("Exécution de l'outil de type 'url_from_template': '%s'", tool.name)
+    details = tool.execution_details
+    if "query_template" not in details:
+        return f"Erreur: 'execution_details' mal configuré pour l'outil '{tool.name}'. Attendu: 'query_template'."
+
+    # Récupérer le template et injecter les variables de configuration globales
+    template_string = details["query_template"]
+    if '{SEARXNG_BASE_URL}' in template_string:
+        searxng_url = current_app.config.get('SEARXNG_BASE_URL', '')
+        template_string = template_string.replace('{SEARXNG_BASE_URL}', searxng_url)
+
+    # Formater l'URL avec les paramètres spécifiques à l'outil
+    url_to_read = template_string.format(**parameters)
+
+    # Appeler directement la fonction de lecture de page web
+    logger.info("Lecture directe de l'URL générée : %s", url_to_read)
+    result = read_webpage_task(url_to_read)
+
+    # Formater la sortie pour être cohérente avec les autres outils
+    return f"--- Contenu de l'URL 1: {url_to_read} ---\n{result}\n\n"
+
+# Table de dispatch par type d'outil : ajouter un type revient à ajouter une entrée.
+_TOOL_TYPE_HANDLERS = {
+    "internal_function": _run_internal_function,
+    "api_call": _run_api_call,
+    "search_and_read_webpage": _run_search_and_read_webpage,
+    "url_from_template": _run_url_from_template,
+}
+
+def _execute_tool(tool_name: str, parameters: dict, user_question: str, prefetched_search_results: Optional[list] = None) -> str:
     """
     Exécute un outil en fonction de sa configuration (type, détails d'exécution).
+    `prefetched_search_results` permet à 'search_web' de réutiliser une recherche déjà effectuée pour la même requête.
     """
-    logger.info(f"Tentative d'exécution de l'outil '{tool_name}' avec les paramètres : {parameters}")
+    logger.info("Tentative d'exécution de l'outil '%s' avec les paramètres : %s", tool_name, parameters)
 
-    # 1. Retrouver la configuration complète de l'outil
-    available_tools = current_app.config.get('AVAILABLE_TOOLS', [])
-    tool_config = next((tool for tool in available_tools if tool.get('name') == tool_name), None)
+    # 1. Retrouver la configuration complète de l'outil (pré-calculée au démarrage, voir tools_definitions)
+    tool = current_app.config.get('TOOLS_BY_NAME', {}).get(tool_name)
 
-    if not tool_config:
+    if not tool:
         error_msg = f"Erreur: La configuration pour l'outil '{tool_name}' est introuvable."
         logger.error(error_msg)
         return error_msg
 
-    tool_type = tool_config.get("type")
-
     # 2. Exécuter l'outil en fonction de son type
-    try:
-        if tool_type == "internal_function":
-            # Logique pour les fonctions internes (tâches Celery)
-            if tool_name == "search_web":
-                query = parameters.get("query", "")
-                logger.info(f"Orchestrateur : appel de la fonction interne 'search_web' avec la requête : {query}")
-                
-                # Récupérer les paramètres configurables depuis tools_config.json, avec des valeurs par défaut.
-                details = tool_config.get("execution_details", {})
-                pages_to_read = details.get("pages_to_read", 1)
-                excerpts_to_show = details.get("excerpts_to_show", 4)
-                
-                search_results = search_web_task(query=query)
-                if not isinstance(search_results, list) or not search_results:
-                    return "La recherche n'a retourné aucun résultat."
-
-                # --- Lecture en parallèle des pages principales ---
-                urls_to_read = [res.get('url') for res in search_results[:pages_to_read] if res.get('url')]
-                final_context = ""
-                
-                if urls_to_read:
-                    logger.info(f"Lecture en parallèle de {len(urls_to_read)} page(s) web...")
-                    pool = GreenPool()
-                    read_contents = list(pool.imap(read_webpage_task, urls_to_read))
-                    
-                    final_context += "--- CONTENU DES PAGES PRINCIPALES ---\n"
-                    for i, content in enumerate(read_contents):
-                        final_context += f"Source {i+1}: {urls_to_read[i]}\nContenu:\n{content}\n---\n"
-                
-                # --- Ajout des extraits des pages suivantes ---
-                excerpt_results = search_results[pages_to_read : pages_to_read + excerpts_to_show]
-                if excerpt_results:
-                    final_context += "\n--- AUTRES RÉSULTATS DE RECHERCHE (EXTRAITS) ---\n"
-                    final_context += _format_results_as_context(excerpt_results)
-                    
-                return final_context
-            elif tool_name == "read_webpage":
-                urls = parameters.get("url", [])
-                if isinstance(urls, str):
-                    # Si une seule URL est fournie, on la traite comme une liste d'un seul élément.
-                    urls = [urls]
-                
-                if not urls:
-                    return "Erreur: Aucune URL n'a été fournie."
-
-                logger.info(f"Orchestrateur : appel de la fonction interne 'read_webpage' sur {len(urls)} URL(s).")
-                
-                pool = GreenPool()
-                read_contents = list(pool.imap(read_webpage_task, urls))
-                
-                final_context = ""
-                for i, content in enumerate(read_contents):
-                    final_context += f"--- Contenu de l'URL {i+1}: {urls[i]} ---\n{content}\n\n"
-                
-                return final_context.strip()
-            else:
-                error_msg = f"Fonction interne non implémentée: '{tool_name}'"
-                logger.warning(error_msg)
-                return error_msg
-
-        elif tool_type == "api_call":
-            # Nouvelle logique pour les appels API
-            details = tool_config.get("execution_details")
-            if not details:
-                return f"Erreur: 'execution_details' manquant pour l'outil API '{tool_name}'."
-
-            method = details.get("method", "GET").upper()
-            # Gère les secrets via les variables d'environnement (ex: $API_KEY)
-            headers = {k: os.path.expandvars(str(v)) for k, v in details.get("headers", {}).items()}
-            
-            url_template = details.get("url_template", details.get("url", ""))
-            if "url_template" in details:
-                # URL-encode les paramètres pour gérer les espaces et caractères spéciaux de manière sécurisée.
-                encoded_params = {k: urllib.parse.quote(str(v)) for k, v in parameters.items()}
-                url = url_template.format(**encoded_params)
-            else:
-                url = details.get("url", "") # Fallback si aucun template n'est fourni
-
-            logger.info(f"Appel API: {method} {url}")
-            # OLD_CODE_FOR_REMOVAL: response = requests.request(method, url, headers=headers, timeout=15)
-            response = eventlet.spawn(requests.request, method, url, headers=headers, timeout=15).wait()
-            response.raise_for_status()
-            return response.text
-
-        elif tool_type == "search_and_read_webpage":
-            logger.info(f"Exécution de l'outil de type 'search_and_read_webpage': '{tool_name}'")
-            details = tool_config.get("execution_details")
-            if not details or "query_template" not in details:
-                return f"Erreur: 'execution_details' mal configuré pour l'outil '{tool_name}'. Attendu: 'query_template'."
-
-            query = details["query_template"].format(**parameters)
-            pages_to_read = details.get("pages_to_read", 1)
-
-            logger.info(f"Recherche générée pour '{tool_name}': {query}")
-            search_results = search_web_task(query=query)
-            if not isinstance(search_results, list) or not search_results:
-                return "La recherche n'a retourné aucun résultat."
-
-            urls_to_read = [res.get('url') for res in search_results[:pages_to_read] if res.get('url')]
-
-            if not urls_to_read:
-                return "La recherche n'a retourné aucune URL à lire."
-
-            logger.info(f"Lecture en parallèle de {len(urls_to_read)} page(s) web...")
-            pool = GreenPool()
-            read_contents = list(pool.imap(read_webpage_task, urls_to_read))
-
-            search_and_read_context = ""
-            for i, content in enumerate(read_contents):
-                search_and_read_context += f"--- Contenu de l\'URL {i+1}: {urls_to_read[i]} ---\n{content}\n\n"
-
-            # --- Logique d'enrichissement pour la météo ---
-            if tool_name == "get_detailed_weather":
-                supplementary_context = ""
-                keywords_to_check = ["insecte", "moustique", "pollen", "qualité de l'air", "uv", "humidex"]
-
-                keywords_found = [kw for kw in keywords_to_check if kw in user_question.lower()]
-                if keywords_found:
-                    logger.info(f"La question météo contient des mots-clés spécifiques ({keywords_found}). Lancement d'une recherche web pour enrichir les données.")
-
-                    location = parameters.get("location", "l'endroit demandé")
-                    search_terms = ", ".join(keywords_found)
-                    supplementary_query = f"prévision {search_terms} pour {location}"
-
-                    supplementary_search_results = search_web_task(query=supplementary_query)
-                    if supplementary_search_results:
-                        supplementary_context = "\n\n--- Informations complémentaires (recherche web) ---\n"
-                        supplementary_context += _format_results_as_context(supplementary_search_results[:3])
-                return f"{search_and_read_context}{supplementary_context}"
+    handler = _TOOL_TYPE_HANDLERS.get(tool.type)
+    if handler is None:
+        error_msg = f"Erreur: Type d'outil non supporté '{tool.type}' pour l'outil '{tool_name}'."
+        logger.error(error_msg)
+        return error_msg
 
-            return search_and_read_context.strip()
+    try:
+        return handler(tool, parameters, user_question, prefetched_search_results)
+    except Exception as e:
+        logger.error("Erreur lors de l'exécution de l'outil '%s': %s", tool_name, e, exc_info=True)
+        return f"Erreur lors de l'exécution de l'outil : {e}"
 
-        elif tool_type == "url_from_template":
-            logger.info(f"Exécution de l'outil de type 'url_from_template': '{tool_name}'")
-            details = tool_config.get("execution_details")
-            if not details or "query_template" not in details:
-                return f"Erreur: 'execution_details' mal configuré pour l'outil '{tool_name}'. Attendu: 'query_template'."
+# Pool de green threads partagé par toutes les orchestrations du processus : il borne le nombre de lectures
+# de pages simultanées, pour qu'une rafale d'URLs n'accapare pas le worker ni les connexions sortantes.
+# Les lectures y sont lancées une à une avec `spawn`, qui attend qu'une place se libère : `imap` créerait
+# au contraire un pool interne à chaque appel, sans limite commune aux orchestrations concurrentes.
+_scrape_pool: Optional[GreenPool] = None
 
-            # Récupérer le template et injecter les variables de configuration globales
-            template_string = details["query_template"]
-            if '{SEARXNG_BASE_URL}' in template_string:
-                searxng_url = current_app.config.get('SEARXNG_BASE_URL', '')
-                template_string = template_string.replace('{SEARXNG_BASE_URL}', searxng_url)
+def _get_scrape_pool() -> GreenPool:
+    """Retourne le pool de lecture des pages, créé au premier usage avec la taille SCRAPE_POOL_SIZE."""
+    global _scrape_pool
+    if _scrape_pool is None:
+        _scrape_pool = GreenPool(size=_config_int('SCRAPE_POOL_SIZE', 16))
+    return _scrape_pool
 
-            # Formater l'URL avec les paramètres spécifiques à l'outil
-            url_to_read = template_string.format(**parameters)
+def _read_webpages(urls: List[str]) -> List[str]:
+    """
+    Lit plusieurs pages web en parallèle et retourne leurs contenus dans l'ordre des URLs.
+    Le temps total tend vers celui de la page la plus lente plutôt que vers la somme des latences.
+    """
+    pool = _get_scrape_pool()
+    if len(urls) == 1:
+        return [pool.spawn(read_webpage_task, urls[0]).wait()]
 
-            # Appeler directement la fonction de lecture de page web
-            logger.info(f"Lecture directe de l'URL générée : {url_to_read}")
-            result = read_webpage_task(url_to_read)
+    if _is_enabled(current_app.config.get('DISTRIBUTED_SCRAPING', False)):
+        # Répartit les lectures sur l'ensemble du pool de workers Celery (plusieurs processus).
+        logger.info("Lecture distribuée de %s page(s) web via un groupe Celery...", len(urls))
+        try:
+            job = group(read_webpage_task.s(url) for url in urls).apply_async()
+            return job.get(timeout=30, disable_sync_subtasks=False)
+        except Exception as e:
+            # Broker indisponible ou workers saturés (ex: déploiement à un seul worker) : on lit les pages localement.
+            logger.warning("Échec de la lecture distribuée (%s). Repli sur la lecture en parallèle dans le worker courant.", e)
 
-            # Formater la sortie pour être cohérente avec les autres outils
-            return f"--- Contenu de l'URL 1: {url_to_read} ---\n{result}\n\n"
+    logger.info("Lecture en parallèle de %s page(s) web...", len(urls))
+    # On passe par la tâche (et non `_scrape_one`) : la ContextTask pousse le contexte
+    # applicatif Flask dans chaque green thread.
+    readers = [pool.spawn(read_webpage_task, url) for url in urls]
+    return [reader.wait() for reader in readers]
 
-        else:
-            error_msg = f"Erreur: Type d'outil non supporté '{tool_type}' pour l'outil '{tool_name}'."
-            logger.error(error_msg)
-            return error_msg
-
-    except Exception as e:
-        logger.error(f"Erreur lors de l'exécution de l'outil '{tool_name}': {e}", exc_info=True)
-        return f"Erreur lors de l'exécution de l'outil : {e}"
+# Certains moteurs renvoient des extraits de plusieurs milliers de caractères : on les borne pour
+# garder un prompt de synthèse (et son temps de pré-remplissage) prévisible.
+_RESULT_EXCERPT_MAX_CHARS = 800
 
 def _format_results_as_context(results: List[Dict[str, Any]]) -> str:
     """Formate une liste de résultats de recherche en une chaîne de contexte pour le LLM."""
-    context = ""
     # Limiter aux 5 premiers résultats pour ne pas surcharger le contexte
-    for result in results[:5]:
-        context += f"Titre: {result.get('title', 'N/A')}\n"
-        context += f"URL: {result.get('url', 'N/A')}\n"
-        context += f"Extrait: {result.get('content', 'N/A')}\n---\n"
-    return context
+    return "".join(
+        f"Titre: {result.get('title', 'N/A')}\n"
+        f"URL: {result.get('url', 'N/A')}\n"
+        f"Extrait: {(result.get('content') or 'N/A')[:_RESULT_EXCERPT_MAX_CHARS]}\n---\n"
+        for result in results[:5]
+    )
+
+def _format_page_contents(urls: List[str], contents: List[str]) -> str:
+    """Formate le contenu de pages lues, chacune précédée de son URL, en une chaîne de contexte pour le LLM."""
+    return "".join(
+        f"--- Contenu de l'URL {i}: {url} ---\n{content}\n\n"
+        for i, (url, content) in enumerate(zip(urls, contents), start=1)
+    )
+
+# Prompts système de la synthèse finale, définis une fois pour toutes au chargement du module.
+_SYNTHESIS_SYSTEM_PROMPT_TEMPLATE = """Vous êtes un assistant de synthèse. Votre rôle est de répondre à la question de l'utilisateur EN VOUS BASANT UNIQUEMENT sur les "Informations de recherche" fournies ci-dessous.
+Règle impérative : NE PAS inventer d'informations ou de valeurs qui ne sont pas présentes dans le contexte. Si une information demandée par l'utilisateur (par exemple, le risque d'insectes) n'est pas explicitement listée dans les "Informations de recherche", vous DEVEZ indiquer qu'elle n'a pas pu être trouvée.
+Formatez la réponse de manière claire et lisible.
 
-@celery.task(name="app.tasks.orchestrator_task")
-def orchestrator_task(sid: str, conversation: List[Dict[str, Any]], model_id: str, user_info: Optional[Dict[str, Any]] = None):
+Informations de recherche:\n---\n{tool_results}\n---"""
+_DEFAULT_SYSTEM_PROMPT = "Vous êtes un assistant IA généraliste et serviable."
+
+# Budget du contexte de synthèse. Le coût du pré-remplissage croît avec la longueur du prompt ; sans tokenizer
+# propre à chaque modèle, on estime le nombre de tokens à raison d'environ 4 caractères par token.
+_CHARS_PER_TOKEN = 4
+
+def _truncate_to_token_budget(text: str, max_tokens: int) -> str:
+    """Tronque `text` à environ `max_tokens` tokens, de préférence sur une fin de ligne. `0` désactive la limite."""
+    max_chars = max_tokens * _CHARS_PER_TOKEN
+    if max_tokens <= 0 or len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n", 0, max_chars)
+    if cut < max_chars // 2:
+        cut = max_chars
+    return text[:cut] + "\n[...]"
+
+def _trim_conversation_history(messages: List[Dict[str, Any]], max_messages: int) -> List[Dict[str, Any]]:
+    """Conserve le message système initial et les `max_messages` derniers messages. `0` conserve tout l'historique."""
+    has_system = bool(messages) and messages[0].get("role") == "system"
+    history = messages[1:] if has_system else messages
+    if max_messages <= 0 or len(history) <= max_messages:
+        return messages
+    return messages[:1] + history[-max_messages:] if has_system else history[-max_messages:]
+
+# Streaming de la synthèse vers le client SocketIO : les tokens sont regroupés pour limiter le nombre
+# de messages publiés sur la file Redis (un emit par token sature la file au-delà de quelques dizaines de tokens/s).
+_STREAM_EMIT_MAX_TOKENS = 8
+_STREAM_EMIT_INTERVAL = 0.05  # secondes
+
+def _stream_synthesis(model_id: str, synthesis_messages: List[Dict[str, Any]], sid: str) -> str:
+    """
+    Exécute l'appel de synthèse en streaming et relaie les tokens au client `sid` par lots
+    (événement 'task_result', statut 'streaming_update'). Retourne la réponse complète.
+    """
+    stream = _execute_llm_request(model_name=model_id, messages=synthesis_messages, stream=True)
+    pieces, pending = [], []
+    last_emit = time.monotonic()
+    for chunk in stream:
+        if not chunk.choices or not (token := chunk.choices[0].delta.content):
+            continue
+        pieces.append(token)
+        pending.append(token)
+        now = time.monotonic()
+        if len(pending) >= _STREAM_EMIT_MAX_TOKENS or now - last_emit >= _STREAM_EMIT_INTERVAL:
+            socketio.emit('task_result', {'status': 'streaming_update', 'tokens': pending}, to=sid)
+            pending = []
+            last_emit = now
+    if pending:
+        socketio.emit('task_result', {'status': 'streaming_update', 'tokens': pending}, to=sid)
+    return "".join(pieces)
+
+# Acquittement après exécution : si le worker entier s'arrête en pleine orchestration (redémarrage du conteneur,
+# perte de connexion au broker), le message non acquitté est remis en file au lieu d'être perdu. Une orchestration
+# qui tue elle-même son processus d'exécution (mémoire épuisée, limite de temps dure) est en revanche marquée
+# en échec plutôt que rejouée : elle échouerait de nouveau, en relançant à chaque fois tous ses appels LLM.
+@celery.task(name="app.tasks.orchestrator_task", acks_late=True)
+def orchestrator_task(sid: str, conversation: List[Dict[str, Any]], model_id: str, user_info: Optional[Dict[str, Any]] = None,
+                      stream_tokens: bool = False):
     """
     Tâche Celery qui orchestre la décision de l'IA et lance le flux de travail approprié.
     Le résultat de cette tâche est la réponse finale, la rendant compatible avec le polling HTTP.
+    Avec `stream_tokens` (client SocketIO identifié par `sid`) et SYNTHESIS_STREAMING actif, les tokens de la
+    synthèse sont en plus relayés au client au fil de leur génération.
     """
+    # Résolution unique du proxy `current_app` pour toute la tâche.
+    config = current_app.config
     try:
         # Déterminer le modèle à utiliser pour le routage.
         # Si ROUTING_BACKEND_NAME est défini, on utilise le modèle par défaut de ce backend.
         # Sinon, on se rabat sur le modèle choisi par l'utilisateur.
-        routing_backend_name = current_app.config.get("ROUTING_BACKEND_NAME")
+        routing_backend_name = config.get("ROUTING_BACKEND_NAME")
         routing_model_id = model_id  # Fallback par défaut sur le modèle de l'utilisateur
 
         if routing_backend_name:
@@ -371,115 +763,173 @@ def orchestrator_task(sid: str, conversation: List[Dict[str, Any]], model_id: st
                 # Cela garantit que le bon backend est appelé avec son modèle par défaut.
                 default_model = routing_backend_config.get('default_model')
                 routing_model_id = f"{routing_backend_name}/{default_model}"
-                logger.info(f"Utilisation du backend de routage '{routing_backend_name}' avec le modèle '{default_model}'.")
+                logger.info("Utilisation du backend de routage '%s' avec le modèle '%s'.", routing_backend_name, default_model)
             else:
-                logger.warning(f"ROUTING_BACKEND_NAME '{routing_backend_name}' est configuré mais le backend ou son modèle par défaut est introuvable. Utilisation du modèle de l'utilisateur pour le routage.")
+                logger.warning("ROUTING_BACKEND_NAME '%s' est configuré mais le backend ou son modèle par défaut est introuvable. Utilisation du modèle de l'utilisateur pour le routage.", routing_backend_name)
         else:
             logger.warning("ROUTING_BACKEND_NAME n'est pas configuré, utilisation du modèle de l'utilisateur pour le routage.")
 
         # Extraire la question la plus récente de l'historique des messages pour la prise de décision.
-        user_question = ""
-        if conversation and isinstance(conversation, list) and conversation[-1].get("role") == "user":
-            user_question = conversation[-1].get("content", "")
+        # Les conversations reçues sont presque toujours bien formées : accès direct, exceptions pour les cas dégradés.
+        try:
+            last_message = conversation[-1]
+            user_question = last_message["content"] if last_message["role"] == "user" else ""
+        except (IndexError, KeyError, TypeError):
+            user_question = ""
 
         if not user_question or not isinstance(user_question, str):
-            logger.error(f"Impossible d'extraire une question utilisateur valide des messages pour SID {sid}.")
-            # Fallback LLM pour message utilisateur en cas d'erreur
-            admin_email = current_app.config.get("SYSTEM_ADMIN_EMAIL", "admin@harpou.ai")
-            fallback_prompt = (
+            logger.error("Impossible d'extraire une question utilisateur valide des messages pour SID %s.", sid)
+            # Message d'excuse statique : sur un chemin d'erreur, l'utilisateur ne doit pas attendre un appel LLM
+            # supplémentaire (qui risque d'ailleurs d'échouer pour la même raison).
+            admin_email = config.get("SYSTEM_ADMIN_EMAIL", "admin@harpou.ai")
+            return (
                 "Je rencontre une difficulté technique pour traiter votre demande. "
                 f"Veuillez contacter l'administrateur système à l'adresse {admin_email}."
             )
-            try:
-                # On tente de demander au LLM de reformuler le message d'excuse
-                llm_fallback = get_llm_completion(
-                    f"Formule un message d'excuse poli à transmettre à l'utilisateur en cas de panne technique. "
-                    f"Indique qu'il peut contacter l'administrateur à {admin_email}.",
-                    model_name=model_id,
-                    json_mode=False
-                )
-                return llm_fallback if llm_fallback else fallback_prompt
-            except Exception as e:
-                logger.error(f"Erreur lors de la génération du fallback LLM : {e}")
-                return fallback_prompt
 
         # Initialisation des variables pour la boucle de raisonnement
-        max_iterations = current_app.config.get("REASONING_LOOP_BUDGET", 1) # Par défaut à 1 pour désactiver la boucle
+        max_iterations = config.get("REASONING_LOOP_BUDGET", 1) # Par défaut à 1 pour désactiver la boucle
         current_iteration = 0
         start_time = datetime.now()
-        reasoning_time_budget_seconds = current_app.config.get("REASONING_TIME_BUDGET_SECONDS", 45)
+        reasoning_time_budget_seconds = config.get("REASONING_TIME_BUDGET_SECONDS", 45)
+
+        # Réponse directe du routeur : lorsqu'il utilise le modèle de l'utilisateur sur une question isolée,
+        # sans persona ni dépendance à l'heure, sa réponse vaut celle de la synthèse et évite un second appel LLM.
+        # La conversation doit se réduire à la question : le routeur ne voit pas le message système du client
+        # (préréglage Open WebUI...), que sa réponse ignorerait.
+        allow_router_answer = (
+            _is_enabled(config.get("ROUTER_DIRECT_ANSWER", True))
+            and routing_model_id == model_id
+            and len(conversation) == 1
+            and not (user_info and user_info.get("persona_prompt_file"))
+            and not _TIME_SENSITIVE_RE.search(user_question)
+        )
+
+        # Heuristiques locales : les cas évidents (salutations, calculs, URL fournie...) sont aiguillés sans LLM.
+        is_internal_ui_task = user_question.strip().startswith("### Task:")
+        heuristic_decision = None
+        if not is_internal_ui_task and _is_enabled(config.get("ROUTING_HEURISTICS", True)):
+            heuristic_decision = fast_route(user_question, config.get('TOOLS_BY_NAME', {}))
+
+        # Recherche spéculative (désactivée par défaut) : la plupart des décisions d'outil sont une recherche web
+        # sur la question elle-même. On lance cette recherche pendant que le LLM de routage réfléchit, pour superposer
+        # les deux latences. Elle transmet la question à SearXNG avant toute décision : les messages trop courts
+        # pour être une requête de recherche (salutations, relances) ne sont jamais envoyés.
+        speculative_search = None
+        if (_is_enabled(config.get("SPECULATIVE_SEARCH", False))
+                and config.get("SEARXNG_BASE_URL")
+                and not is_internal_ui_task
+                and heuristic_decision is None
+                and len(user_question.split()) >= _SPECULATIVE_SEARCH_MIN_WORDS):
+            # On passe par la tâche (et non une fonction interne) : ContextTask fournit le contexte applicatif au green thread.
+            speculative_search = eventlet.spawn(search_web_task, user_question)
 
         tool_results = ""
-        synthesis_messages = copy.deepcopy(conversation)
+        # Copie superficielle : seul le message système (index 0) est remplacé, jamais modifié en place.
+        synthesis_messages = list(conversation)
         final_answer = ""
         
-        while current_iteration < max_iterations:
-            current_iteration += 1
-            elapsed_time = (datetime.now() - start_time).total_seconds()
+        try:
+            while current_iteration < max_iterations:
+                current_iteration += 1
+                elapsed_time = (datetime.now() - start_time).total_seconds()
             
-            budget_context = {
-                "current_iteration": current_iteration,
-                "max_iterations": max_iterations,
-                "elapsed_time_seconds": round(elapsed_time),
-                "remaining_time_seconds": round(reasoning_time_budget_seconds - elapsed_time),
-                "reasoning_time_budget_seconds": reasoning_time_budget_seconds
-            }
-            logger.info(f"SID {sid}: Début de l'itération {current_iteration}. Contexte du budget: {budget_context}")
-
-            # --- Étape de Décision ---
-            # Les requêtes internes de Open WebUI pour les titres, tags, etc., commencent par "### Task:".
-            # Celles-ci ne doivent pas passer par la logique d'outils mais être traitées directement.
-            if user_question.strip().startswith("### Task:"):
-                logger.info(f"Requête interne de l'UI détectée pour SID {sid}. Contournement de la logique d'outils.")
-                # On force la décision à "répondre directement" pour sauter l'exécution d'outil.
-                decision = {"action": "respond_directly"}
-            else:
-                # Pour les requêtes utilisateur standard, on appelle le LLM de routage.
-                decision = get_llm_decision(user_question, model_name=routing_model_id) # OLD_CODE_FOR_REMOVAL: Cette ligne sera remplacée à l'étape 4
-
-            # --- Étape de Validation et Normalisation de la Décision ---
-            # On ajoute une couche de validation pour se prémunir contre les "hallucinations"
-            # du LLM de routage, qui peut parfois retourner des outils inexistants ou omettre des paramètres.
-            if decision.get("action") == "call_tool":
-                tool_name_from_llm = decision.get("tool_name") or decision.get("outil")
-                # On vérifie si les paramètres sont présents, même s'ils sont vides.
-                parameters_from_llm = decision.get("parameters") if "parameters" in decision else decision.get("paramètres")
-                
-                available_tools_names = {tool['name'] for tool in current_app.config.get('AVAILABLE_TOOLS', [])}
-
-                # On vérifie que l'outil demandé existe ET que le champ des paramètres est bien présent.
-                if tool_name_from_llm not in available_tools_names or parameters_from_llm is None:
-                    log_message = (
-                        f"Le LLM de routage a fourni une décision invalide. "
-                        f"Outil: '{tool_name_from_llm}', Paramètres: {parameters_from_llm}. "
-                        f"Forçage de la réponse directe."
-                    )
-                    logger.warning(log_message)
-                    # On écrase la décision invalide du LLM.
+                budget_context = {
+                    "current_iteration": current_iteration,
+                    "max_iterations": max_iterations,
+                    "elapsed_time_seconds": round(elapsed_time),
+                    "remaining_time_seconds": round(reasoning_time_budget_seconds - elapsed_time),
+                    "reasoning_time_budget_seconds": reasoning_time_budget_seconds
+                }
+                logger.info("SID %s: Début de l'itération %s. Contexte du budget: %s", sid, current_iteration, budget_context)
+
+                # --- Étape de Décision ---
+                # Les requêtes internes de Open WebUI pour les titres, tags, etc., commencent par "### Task:".
+                # Celles-ci ne doivent pas passer par la logique d'outils mais être traitées directement.
+                if is_internal_ui_task:
+                    logger.info("Requête interne de l'UI détectée pour SID %s. Contournement de la logique d'outils.", sid)
+                    # On force la décision à "répondre directement" pour sauter l'exécution d'outil.
                     decision = {"action": "respond_directly"}
+                elif heuristic_decision is not None:
+                    logger.info("SID %s: Décision de routage obtenue par heuristique locale, sans appel au LLM.", sid)
+                    decision = heuristic_decision
                 else:
-                    # Normaliser les clés pour le reste du code au cas où le LLM a utilisé 'outil' ou 'paramètres'.
-                    decision['tool_name'] = tool_name_from_llm
-                    decision['parameters'] = parameters_from_llm
-
-            # --- Étape d'Exécution de l'Action ---
-            tool_name = decision.get("tool_name")
-            parameters = decision.get("parameters", {})
-            logger.info(f"SID {sid}: Action décidée - Outil: {tool_name}, Décision: {decision}")
-
-            if decision.get("action") == "call_tool" and tool_name:
-                try:
-                    tool_results = _execute_tool(tool_name, parameters, user_question=user_question)
-                    logger.debug(f"Résultat brut de l'outil '{tool_name}':\n---\n{tool_results}\n---")
-                except Exception as e:
-                    logger.error(f"Erreur inattendue lors de l'appel à _execute_tool pour '{tool_name}' pour SID {sid}: {e}", exc_info=True)
-                    tool_results = f"Erreur critique lors de l'exécution de l'outil : {e}"
+                    # Pour les requêtes utilisateur standard, on appelle le LLM de routage.
+                    decision = get_llm_decision(user_question, model_name=routing_model_id, allow_answer=allow_router_answer) # OLD_CODE_FOR_REMOVAL: Cette ligne sera remplacée à l'étape 4
+
+                # --- Étape de Validation et Normalisation de la Décision ---
+                # On ajoute une couche de validation pour se prémunir contre les "hallucinations"
+                # du LLM de routage, qui peut parfois retourner des outils inexistants ou omettre des paramètres.
+                if decision.get("action") == "call_tool":
+                    tool_name_from_llm = decision.get("tool_name") or decision.get("outil")
+                    # On vérifie si les paramètres sont présents, même s'ils sont vides.
+                    parameters_from_llm = decision.get("parameters") if "parameters" in decision else decision.get("paramètres")
+                
+                    # On vérifie que l'outil demandé existe ET que le champ des paramètres est bien présent.
+                    if tool_name_from_llm not in config.get('TOOLS_BY_NAME', {}) or parameters_from_llm is None:
+                        log_message = (
+                            f"Le LLM de routage a fourni une décision invalide. "
+                            f"Outil: '{tool_name_from_llm}', Paramètres: {parameters_from_llm}. "
+                            f"Forçage de la réponse directe."
+                        )
+                        logger.warning(log_message)
+                        # On écrase la décision invalide du LLM.
+                        decision = {"action": "respond_directly"}
+                    else:
+                        # Normaliser les clés pour le reste du code au cas où le LLM a utilisé 'outil' ou 'paramètres'.
+                        decision['tool_name'] = tool_name_from_llm
+                        decision['parameters'] = parameters_from_llm
+
+                # --- Étape d'Exécution de l'Action ---
+                # Champs de la décision lus une seule fois. Des paramètres nuls ou qui ne sont pas un objet (ex: une chaîne
+                # renvoyée en mode JSON sans schéma) sont ramenés à un objet vide : les valeurs par défaut s'appliquent.
+                action = decision.get("action")
+                tool_name = decision.get("tool_name")
+                parameters = decision.get("parameters")
+                if not isinstance(parameters, dict):
+                    parameters = {}
+                logger.info("SID %s: Action décidée - Outil: %s, Décision: %s", sid, tool_name, decision)
+
+                # La recherche spéculative n'est utilisée que si le routeur a retenu la question telle quelle ;
+                # une requête reformulée reste prioritaire et la recherche spéculative est abandonnée.
+                prefetched_search_results = None
+                if action == "call_tool" and tool_name == "search_web" and not str(parameters.get("query") or "").strip():
+                    # Requête absente ou vide : la question elle-même est la meilleure requête (et c'est celle de la recherche spéculative).
+                    parameters = {**parameters, "query": user_question}
+                if speculative_search is not None:
+                    if (action == "call_tool" and tool_name == "search_web"
+                            and _is_same_search_query(parameters.get("query", ""), user_question)):
+                        try:
+                            prefetched_search_results = speculative_search.wait()
+                        except Exception as e:
+                            logger.warning("La recherche spéculative a échoué pour SID %s, nouvelle recherche : %s", sid, e)
+                    else:
+                        speculative_search.kill()
+                    speculative_search = None
+
+                direct_answer = decision.get("answer")
+                if allow_router_answer and action == "respond_directly" and isinstance(direct_answer, str) and direct_answer.strip():
+                    logger.info("SID %s: Réponse directe fournie par le routeur, synthèse finale non nécessaire.", sid)
+                    return direct_answer
+
+                if action == "call_tool" and tool_name:
+                    try:
+                        tool_results = _execute_tool(tool_name, parameters, user_question=user_question,
+                                                     prefetched_search_results=prefetched_search_results)
+                        logger.debug("Résultat brut de l'outil '%s':\n---\n%s\n---", tool_name, tool_results)
+                    except Exception as e:
+                        logger.error("Erreur inattendue lors de l'appel à _execute_tool pour '%s' pour SID %s: %s", tool_name, sid, e, exc_info=True)
+                        tool_results = f"Erreur critique lors de l'exécution de l'outil : {e}"
             
-            # Pour l'étape 3, nous sortons de la boucle après la première itération
-            break 
+                # Pour l'étape 3, nous sortons de la boucle après la première itération
+                break 
+        finally:
+            # Réponse directe, exception ou décision sans recherche : la recherche spéculative encore en cours est abandonnée.
+            if speculative_search is not None:
+                speculative_search.kill()
 
         # --- Étape de Synthèse Finale ---
-        logger.info(f"Début de la synthèse finale pour SID {sid}.")
+        logger.info("Début de la synthèse finale pour SID %s.", sid)
 
         # 1. Définir le contexte temporel pour le LLM.
         time_context = ""
@@ -493,78 +943,103 @@ def orchestrator_task(sid: str, conversation: List[Dict[str, Any]], model_id: st
             current_time_str = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
             time_context = f"Contexte temporel : La date et l'heure actuelles sont {current_time_str}."
         except Exception as e:
-            logger.error(f"Erreur lors de la récupération de la date/heure : {e}")
+            logger.error("Erreur lors de la récupération de la date/heure : %s", e)
             # Ne pas bloquer l'exécution si la date échoue.
 
         # 2. Déterminer le prompt système de base.
         base_system_prompt = ""
         if tool_results:
             # Si un outil a été utilisé, le prompt se concentre sur la synthèse des résultats.
-            base_system_prompt = f"""Vous êtes un assistant de synthèse. Votre rôle est de répondre à la question de l'utilisateur EN VOUS BASANT UNIQUEMENT sur les "Informations de recherche" fournies ci-dessous.
-Règle impérative : NE PAS inventer d'informations ou de valeurs qui ne sont pas présentes dans le contexte. Si une information demandée par l'utilisateur (par exemple, le risque d'insectes) n'est pas explicitement listée dans les "Informations de recherche", vous DEVEZ indiquer qu'elle n'a pas pu être trouvée.
-Formatez la réponse de manière claire et lisible.
-
-Informations de recherche:\n---\n{tool_results}\n---"""
+            tool_results = _truncate_to_token_budget(tool_results, _config_int('SYNTHESIS_TOOL_CONTEXT_TOKENS', 4000))
+            base_system_prompt = _SYNTHESIS_SYSTEM_PROMPT_TEMPLATE.format(tool_results=tool_results)
         else:
             # Si aucune information externe n'est fournie, on utilise le persona de l'utilisateur ou un prompt par défaut.
             persona_prompt = None
             if user_info and (persona_file := user_info.get("persona_prompt_file")):
                 persona_prompt = _get_prompt_from_file(persona_file)
                 if persona_prompt:
-                    logger.info(f"Persona de l'utilisateur '{user_info.get('username')}' injecté depuis le fichier '{persona_file}'.")
+                    logger.info("Persona de l'utilisateur '%s' injecté depuis le fichier '%s'.", user_info.get('username'), persona_file)
             
-            base_system_prompt = persona_prompt or "Vous êtes un assistant IA généraliste et serviable."
+            base_system_prompt = persona_prompt or _DEFAULT_SYSTEM_PROMPT
 
         # 3. Construire le prompt système final en combinant le temps et le contenu.
         final_system_prompt = f"{time_context}\n\n{base_system_prompt}".strip()
 
-        # 4. Injecter ou mettre à jour le prompt système dans la conversation.
+        # 4. Limiter l'historique transmis, puis injecter ou mettre à jour le prompt système dans la conversation.
+        history_length = len(synthesis_messages)
+        synthesis_messages = _trim_conversation_history(synthesis_messages, _config_int('SYNTHESIS_HISTORY_MESSAGES', 0))
+        if len(synthesis_messages) < history_length:
+            logger.info("SID %s: %s message(s) ancien(s) omis de l'historique transmis à la synthèse.", sid, history_length - len(synthesis_messages))
         if synthesis_messages and synthesis_messages[0].get("role") == "system":
-            synthesis_messages[0]["content"] = final_system_prompt
+            synthesis_messages[0] = {**synthesis_messages[0], "content": final_system_prompt}
         else:
             synthesis_messages.insert(0, {"role": "system", "content": final_system_prompt})
 
         # La valeur retournée ici est le résultat de la tâche Celery,
         # qui sera récupéré par l'endpoint de polling HTTP.
         try:
-            logger.info(f"Appel final au LLM pour synthèse pour SID {sid}.")
-            response_obj = _execute_llm_request(
-                model_name=model_id,
-                messages=synthesis_messages,
-                stream=False
-            )
-            final_answer = response_obj.choices[0].message.content
-            logger.info(f"Réponse finale synthétisée pour SID {sid}: '{final_answer[:100]}...' ")
+            logger.info("Appel final au LLM pour synthèse pour SID %s.", sid)
+            if stream_tokens and _is_enabled(config.get("SYNTHESIS_STREAMING", False)):
+                final_answer = _stream_synthesis(model_id, synthesis_messages, sid)
+            else:
+                response_obj = _execute_llm_request(
+                    model_name=model_id,
+                    messages=synthesis_messages,
+                    stream=False
+                )
+                final_answer = response_obj.choices[0].message.content
+            logger.info("Réponse finale synthétisée pour SID %s: '%s...' ", sid, final_answer[:100])
 
             # --- Sécurité finale : Ne jamais retourner une réponse vide ---
             if not final_answer or not final_answer.strip():
-                logger.warning(f"Le LLM de synthèse a retourné une réponse vide pour SID {sid}. Envoi d'un message d'erreur à l'utilisateur.")
+                logger.warning("Le LLM de synthèse a retourné une réponse vide pour SID %s. Envoi d'un message d'erreur à l'utilisateur.", sid)
                 final_answer = "Désolé, je n'ai pas pu générer de réponse pour votre demande. Veuillez essayer de reformuler votre question."
 
             return final_answer
         except Exception as e:
-            logger.error(f"Échec de la synthèse finale pour SID {sid}: {e}", exc_info=True)
-            admin_email = current_app.config.get("SYSTEM_ADMIN_EMAIL", "admin@harpou.ai")
-            fallback_msg = (
+            logger.error("Échec de la synthèse finale pour SID %s: %s", sid, e, exc_info=True)
+            # Le backend de synthèse vient d'échouer : un second appel pour reformuler l'excuse échouerait probablement aussi.
+            admin_email = config.get("SYSTEM_ADMIN_EMAIL", "admin@harpou.ai")
+            return (
                 "Je rencontre une difficulté technique pour générer la réponse finale. "
                 f"Veuillez contacter l'administrateur système à l'adresse {admin_email}."
             )
-            try:
-                llm_fallback = get_llm_completion(
-                    f"Formule un message d'excuse poli à transmettre à l'utilisateur en cas de panne technique. "
-                    f"Indique qu'il peut contacter l'administrateur à {admin_email}.",
-                    model_name=model_id,
-                    json_mode=False
-                )
-                return llm_fallback if llm_fallback else fallback_msg
-            except Exception as e2:
-                logger.error(f"Erreur lors de la génération du fallback LLM synthèse : {e2}")
-                return fallback_msg
     except Exception as e:
-        logger.error(f"Erreur inattendue dans orchestrator_task pour SID {sid}: {e}", exc_info=True)
+        logger.error("Erreur inattendue dans orchestrator_task pour SID %s: %s", sid, e, exc_info=True)
         return "Désolé, une erreur est survenue lors du traitement de votre demande."
 
-@celery.task(name="app.tasks.refresh_models_cache_task")
+def submit_orchestration(sid: str, conversation: List[Dict[str, Any]], model_id: str,
+                         user_info: Optional[Dict[str, Any]] = None, stream_tokens: bool = False) -> AsyncResult:
+    """
+    Envoie une tâche d'orchestration au broker.
+    Avec ORCHESTRATION_DEDUP_TTL, une conversation identique (même modèle, même utilisateur) soumise à nouveau
+    pendant ce délai (double envoi, rechargement de page) réutilise la tâche existante au lieu d'en relancer une.
+    Sans `user_info`, l'appelant n'est pas identifiable : la conversation n'est jamais dédupliquée.
+    """
+    task_kwargs = {"sid": sid, "conversation": conversation, "model_id": model_id,
+                   "user_info": user_info, "stream_tokens": stream_tokens}
+    dedup_ttl = _config_int('ORCHESTRATION_DEDUP_TTL', 0)
+    if dedup_ttl <= 0 or not user_info:
+        return orchestrator_task.apply_async(kwargs=task_kwargs)
+
+    payload = orjson.dumps([model_id, conversation, user_info], option=orjson.OPT_SORT_KEYS).decode()
+    task_id = str(uuid.uuid4())
+    existing_task_id = claim_orchestration(payload, task_id, timeout=dedup_ttl)
+    if existing_task_id:
+        logger.info("Conversation déjà soumise : réutilisation de la tâche d'orchestration %s pour SID %s.", existing_task_id, sid)
+        return AsyncResult(existing_task_id, app=celery)
+    try:
+        return orchestrator_task.apply_async(kwargs=task_kwargs, task_id=task_id)
+    except Exception:
+        # La tâche n'a pas atteint le broker : sans libération, les nouvelles tentatives attendraient
+        # jusqu'à l'expiration de la réservation une tâche qui ne s'exécutera jamais.
+        release_orchestration(payload)
+        raise
+
+# Limite de temps souple : un rafraîchissement bloqué ne doit pas occuper indéfiniment un slot partagé avec les orchestrations.
+# Le résultat n'est jamais lu (le cache est mis à jour par effet de bord) et un rafraîchissement resté
+# en file plus de 5 minutes est dépassé par le suivant : inutile de l'exécuter.
+@celery.task(name="app.tasks.refresh_models_cache_task", soft_time_limit=120, ignore_result=True, expires=300)
 def refresh_models_cache_task():
     """
     Tâche Celery périodique pour rafraîchir le cache des modèles.
@@ -574,57 +1049,327 @@ def refresh_models_cache_task():
         refresh_and_cache_models()
         logger.info("Tâche de rafraîchissement du cache des modèles terminée avec succès.")
     except Exception as e:
-        logger.error(f"Erreur lors de la tâche de rafraîchissement du cache des modèles: {e}", exc_info=True)
+        logger.error("Erreur lors de la tâche de rafraîchissement du cache des modèles: %s", e, exc_info=True)
+
+# SearXNG renvoie une vingtaine de résultats, chacun avec de nombreux champs (moteurs, scores, positions...).
+# Seuls les premiers résultats et ces trois champs sont utilisés (pages à lire, extraits) : le reste alourdirait
+# inutilement le cache et les messages Celery.
+_MAX_SEARCH_RESULTS = 10
+_SEARCH_RESULT_FIELDS = ("title", "url", "content")
+
+# Seul le JSON est exploitable : on l'annonce explicitement plutôt que de s'en remettre au seul paramètre `format`.
+_SEARCH_HEADERS = {"Accept": "application/json"}
+
+def _trim_search_results(results: list) -> list:
+    """Réduit les résultats SearXNG aux premiers résultats et aux champs utilisés par les outils."""
+    return [
+        {field: result[field] for field in _SEARCH_RESULT_FIELDS if field in result}
+        for result in results[:_MAX_SEARCH_RESULTS]
+        if isinstance(result, dict)
+    ]
 
 @celery.task()
-def search_web_task(query: str) -> list:
+def search_web_task(query: str, no_cache: bool = False) -> list:
     """
     Effectue une recherche web pour la requête donnée et retourne les résultats.
+    Avec `no_cache=True`, le cache est ignoré en lecture et les nouveaux résultats remplacent l'entrée existante.
     """
-    logger.info(f"Début de la recherche pour : '{query}'")
+    logger.info("Début de la recherche pour : '%s'", query)
     searxng_url = current_app.config.get('SEARXNG_BASE_URL')
 
     if not searxng_url:
         logger.error("L'URL de SearXNG n'est pas configurée (SEARXNG_BASE_URL).")
         return []
-    
+
+    cache_ttl = _config_int('SEARCH_CACHE_TTL', 180)
+    if cache_ttl > 0 and not no_cache and (cached_results := get_cached_search_results(query)) is not None:
+        logger.info("Résultats de recherche servis depuis le cache pour : '%s'", query)
+        return cached_results
+
     try:
-        search_url = f"{searxng_url}/search?q={query}&format=json"
-        response = requests.get(search_url, timeout=10)
+        # `params` délègue l'encodage de la requête à requests (caractères spéciaux, espaces, '&'...).
+        response = _HTTP.get(
+            f"{searxng_url}/search",
+            params={"q": query, "format": "json"},
+            headers=_SEARCH_HEADERS,
+            timeout=_SEARCH_TIMEOUT,
+        )
         response.raise_for_status()
-        return response.json().get("results", [])
+        # orjson analyse directement les octets de la réponse, sans passer par `response.text`.
+        results = _trim_search_results(orjson.loads(response.content).get("results", []))
+        if results and cache_ttl > 0:
+            set_cached_search_results(query, results, timeout=cache_ttl)
+        return results
+    except requests.exceptions.Timeout as e:
+        # Distingué des erreurs de connexion : une instance lente n'appelle pas le même diagnostic qu'une instance arrêtée.
+        logger.error("Délai dépassé en attendant SearXNG (%s) : %s", query, e)
+        return []
     except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur de connexion à SearXNG : {e}")
+        logger.error("Erreur de connexion à SearXNG : %s", e)
         return []
-    except json.JSONDecodeError as e:
-        logger.error(f"Erreur de décodage de la réponse JSON de SearXNG : {e}")
+    except orjson.JSONDecodeError as e:
+        logger.error("Erreur de décodage de la réponse JSON de SearXNG : %s", e)
         return []
 
-@celery.task()
-def read_webpage_task(url: str) -> str:
+# Balises sans contenu utile pour le LLM, retirées avant l'extraction du texte.
+_NON_CONTENT_TAGS = ["script", "style", "nav", "footer", "header", "aside"]
+# Éléments de type bloc : seul le texte de blocs distincts est séparé par un saut de ligne. Les éléments en ligne
+# (<b>, <a>, <span>...) restent dans leur phrase, et les blancs du code source sont réduits à une espace.
+_BLOCK_TAGS = [
+    "address", "article", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "figure", "form",
+    "h1", "h2", "h3", "h4", "h5", "h6", "hr", "li", "main", "ol", "p", "pre", "section",
+    "table", "td", "th", "title", "tr", "ul",
+]
+# Marqueur de fin de bloc (caractère à usage privé, qui n'est pas un blanc) remplacé par un saut de ligne après réduction des blancs.
+_BLOCK_BREAK = "\ue000"
+_WHITESPACE_RUN_RE = re.compile(r'\s+')
+
+def _join_text_blocks(text: str) -> str:
+    """Réduit les blancs du texte extrait à une espace, puis place chaque bloc sur sa propre ligne."""
+    return _WHITESPACE_RUN_RE.sub(' ', text).replace(_BLOCK_BREAK, '\n')
+
+# Nombre maximal d'octets HTML lus par page : largement suffisant pour produire 8000 caractères de texte.
+_MAX_PAGE_BYTES = 256_000
+
+# Nettoyage du texte extrait : deux substitutions regex (en C) au lieu de générateurs Python imbriqués.
+# Deux espaces consécutifs ou plus séparent des fragments distincts (cellules, colonnes...) ;
+# les sauts de ligne absorbent les blancs qui les entourent, ce qui supprime aussi les lignes vides.
+_SPACE_RUN_RE = re.compile(r' {2,}')
+_LINE_BREAK_RE = re.compile(r'\s*[\r\n]\s*')
+
+def _clean_extracted_text(text: str) -> str:
+    """Normalise les blancs du texte d'une page : un fragment non vide par ligne, sans espaces superflus."""
+    text = _SPACE_RUN_RE.sub('\n', text)
+    return _LINE_BREAK_RE.sub('\n', text).strip()
+
+# Sélection des passages pertinents : le texte d'une page est découpé en blocs de lignes consécutives,
+# classés par BM25 contre la question, afin de n'envoyer à la synthèse que les passages utiles.
+_WORD_RE = re.compile(r'\w+')
+_PASSAGE_TARGET_CHARS = 400
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+
+def _tokenize(text: str) -> List[str]:
+    """Découpe un texte en mots normalisés (minuscules, sans accents) pour le calcul de pertinence."""
+    return _WORD_RE.findall(_normalize_string(text).casefold())
+
+def _split_passages(text: str) -> List[str]:
+    """Regroupe les lignes consécutives d'un texte nettoyé en passages d'environ `_PASSAGE_TARGET_CHARS` caractères."""
+    passages, current, current_len = [], [], 0
+    for line in text.split('\n'):
+        current.append(line)
+        current_len += len(line) + 1
+        if current_len >= _PASSAGE_TARGET_CHARS:
+            passages.append('\n'.join(current))
+            current, current_len = [], 0
+    if current:
+        passages.append('\n'.join(current))
+    return passages
+
+def _select_relevant_passages(text: str, question: str, max_chars: int) -> str:
     """
-    Scrape le contenu textuel d'une page web à partir de son URL.
+    Réduit `text` à au plus `max_chars` caractères en conservant les passages les mieux classés par BM25
+    pour `question`, dans leur ordre d'origine. Sans terme commun avec la question, le début du texte est conservé.
     """
-    if not url or not url.startswith(('http://', 'https://')):
-        return f"Erreur: URL invalide fournie : '{url}'"
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+
+    passages = _split_passages(text)
+    query_terms = set(_tokenize(question))
+    tokenized = [_tokenize(passage) for passage in passages]
+
+    document_frequency = {}
+    for tokens in tokenized:
+        for term in query_terms.intersection(tokens):
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+    if not document_frequency:
+        return text[:max_chars]
+
+    passage_count = len(passages)
+    average_length = sum(len(tokens) for tokens in tokenized) / passage_count or 1
+    idf = {term: math.log(1 + (passage_count - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    scores = []
+    for tokens in tokenized:
+        length_norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * len(tokens) / average_length)
+        score = 0.0
+        for term, term_idf in idf.items():
+            frequency = tokens.count(term)
+            if frequency:
+                score += term_idf * frequency * (_BM25_K1 + 1) / (frequency + length_norm)
+        scores.append(score)
+
+    selected, used_chars = [], 0
+    for index in sorted(range(passage_count), key=lambda i: scores[i], reverse=True):
+        if scores[index] <= 0:
+            break
+        if used_chars + len(passages[index]) > max_chars:
+            continue
+        selected.append(index)
+        used_chars += len(passages[index]) + 1
+    if not selected:
+        return text[:max_chars]
+    return '\n'.join(passages[i] for i in sorted(selected))
+
+def _is_textual_content_type(content_type: str) -> bool:
+    """Indique si un Content-Type correspond à un document textuel exploitable (HTML, XML, texte brut)."""
+    content_type = content_type.lower()
+    return content_type.startswith('text/') or 'html' in content_type or 'xml' in content_type
+
+# Balise <meta charset="..."> ou <meta http-equiv="Content-Type" content="...; charset=...">,
+# recherchée dans le début du document comme le font les navigateurs.
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+_META_CHARSET_SCAN_BYTES = 4096
+
+def _lookup_encoding(name: Optional[str]) -> Optional[str]:
+    """Retourne le nom canonique d'un encodage connu de Python, ou None s'il est absent ou inconnu."""
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name.strip()).name
+    except LookupError:
+        return None
 
-    logger.info(f"Début du scraping pour l'URL : {url}")
+def _detect_document_encoding(content: bytes) -> str:
+    """
+    Détermine l'encodage d'une page dont l'en-tête HTTP ne précise pas le charset :
+    balise <meta charset>, puis UTF-8 si les octets sont valides, sinon windows-1252 (repli des navigateurs).
+    """
+    if match := _META_CHARSET_RE.search(content, 0, _META_CHARSET_SCAN_BYTES):
+        encoding = _lookup_encoding(match.group(1).decode('ascii'))
+        # Une page servie en octets ne peut pas être en UTF-16 : les navigateurs lisent alors de l'UTF-8.
+        if encoding and not encoding.startswith('utf-16'):
+            return encoding
+    try:
+        # Décodage incrémental non final : le corps peut avoir été coupé par le budget d'octets au milieu
+        # d'un caractère multi-octets, ce qui ne doit pas faire rejeter l'UTF-8 pour toute la page.
+        codecs.getincrementaldecoder('utf-8')().decode(content, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+def _extract_text_with_lexbor(content: bytes, encoding: str) -> Optional[str]:
+    """
+    Extrait le texte visible d'une page avec selectolax (moteur lexbor, en C).
+    Le document est décodé au préalable : lexbor lirait sinon les octets en UTF-8 sans tenir compte de <meta charset>.
+    Retourne None si lexbor ne parvient pas à construire un document exploitable.
+    """
     try:
-        headers = {'User-Agent': 'Harpou-AI-Gateway-Scraper/1.0'}
-        page_response = eventlet.spawn(requests.get, url, timeout=15, headers=headers).wait()
-        page_response.raise_for_status()
+        tree = LexborHTMLParser(content.decode(encoding, errors='replace'))
+        tree.strip_tags(_NON_CONTENT_TAGS)
+        if tree.body is None:
+            return None
+        for node in tree.css(",".join(_BLOCK_TAGS)):
+            node.insert_before(_BLOCK_BREAK)
+            node.insert_after(_BLOCK_BREAK)
+        return _join_text_blocks(tree.body.text(separator=""))
+    except Exception as e:
+        logger.warning("Échec de l'analyse lexbor, repli sur lxml : %s", e)
+        return None
 
-        soup = BeautifulSoup(page_response.content, 'html.parser')
-        for script_or_style in soup(["script", "style", "nav", "footer", "header", "aside"]):
-            script_or_style.decompose()
+def _extract_text_with_lxml(content: bytes, encoding: str) -> str:
+    """Extrait le texte visible d'une page avec lxml.html, directement sur l'arbre libxml2 (sans surcouche Python par nœud)."""
+    try:
+        try:
+            tree = lxml_html.document_fromstring(content.decode(encoding, errors='replace'))
+        except ValueError:
+            # Chaîne portant une déclaration XML d'encodage (XHTML) : lxml exige les octets bruts.
+            tree = lxml_html.document_fromstring(content)
+    except etree.ParserError:
+        return ""
+    # drop_tree conserve le texte qui suit la balise retirée (contrairement à remove).
+    for element in list(tree.iter(*_NON_CONTENT_TAGS)):
+        element.drop_tree()
+    # Un bloc par ligne, comme la sortie de lexbor.
+    for element in tree.iter(*_BLOCK_TAGS):
+        element.text = _BLOCK_BREAK + (element.text or "")
+        element.tail = _BLOCK_BREAK + (element.tail or "")
+    return _join_text_blocks("".join(tree.itertext()))
+
+# Repli rapide par regex (exécutées en C) pour les pages volumineuses que lexbor n'a pas pu analyser :
+# parcourir l'arbre d'une page de plusieurs centaines de Ko reste coûteux, même avec lxml.
+_REGEX_FALLBACK_MIN_BYTES = 64 * 1024
+_NON_CONTENT_BLOCK_RE = re.compile(
+    r'<!--.*?-->|<(' + '|'.join(_NON_CONTENT_TAGS) + r')\b[^>]*>.*?</\1\s*>',
+    re.IGNORECASE | re.DOTALL,
+)
+_BLOCK_TAG_RE = re.compile(r'</?(?:' + '|'.join(_BLOCK_TAGS) + r')\b[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+
+def _extract_text_with_regex(content: bytes, encoding: str) -> str:
+    """Extrait approximativement le texte d'une page en retirant les blocs sans contenu puis les balises (un bloc par ligne)."""
+    document = _NON_CONTENT_BLOCK_RE.sub('', content.decode(encoding, errors='replace'))
+    stripped = _TAG_RE.sub('', _BLOCK_TAG_RE.sub(_BLOCK_BREAK, document))
+    return _join_text_blocks(html.unescape(stripped))
+
+def _scrape_one(url: str, no_cache: bool = False) -> str:
+    """
+    Télécharge une page web et retourne son texte nettoyé (tronqué à 8000 caractères).
+    Fonction simple (sans `self` ni dépendance Celery) réutilisable par la tâche et l'orchestrateur.
+    Avec `no_cache=True`, la page est toujours téléchargée et le texte obtenu remplace l'entrée en cache.
+    """
+    if not url or not url.startswith(('http://', 'https://')):
+        return f"Erreur: URL invalide fournie : '{url}'"
 
-        text = soup.get_text()
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        full_text = '\n'.join(chunk for chunk in chunks if chunk)
+    cache_ttl = _config_int('PAGE_CACHE_TTL', 900)
+    if cache_ttl > 0 and not no_cache and (cached_text := get_cached_page(url)) is not None:
+        logger.info("Contenu servi depuis le cache pour l'URL : %s", url)
+        return cached_text
 
-        return full_text[:8000]
+    logger.info("Début du scraping pour l'URL : %s", url)
+    try:
+        # Téléchargement en flux : on arrête de lire dès que le budget d'octets est atteint,
+        # puisque seuls les 8000 premiers caractères de texte seront conservés.
+        with _HTTP.get(url, stream=True, timeout=_PAGE_TIMEOUT, headers=_SCRAPER_HEADERS) as page_response:
+            page_response.raise_for_status()
+
+            content_type = page_response.headers.get('Content-Type', '')
+            if content_type and not _is_textual_content_type(content_type):
+                logger.info("Contenu non textuel ignoré pour l'URL %s (%s).", url, content_type)
+                return f"Erreur: Type de contenu non supporté pour l'URL {url} : {content_type}"
+
+            body = bytearray()
+            for chunk in page_response.iter_content(chunk_size=65536):
+                body.extend(chunk)
+                if len(body) >= _MAX_PAGE_BYTES:
+                    logger.debug("Budget de %s octets atteint pour l'URL %s, lecture interrompue.", _MAX_PAGE_BYTES, url)
+                    break
+
+            # On ne retient l'encodage de requests que s'il est déclaré dans l'en-tête HTTP ; sinon,
+            # requests retombe sur ISO-8859-1 alors que la page peut préciser son charset dans une balise <meta>.
+            # Un charset inconnu de Python (ex: "utf8mb4") est ignoré comme s'il était absent.
+            declared_encoding = _lookup_encoding(page_response.encoding) if 'charset' in content_type.lower() else None
+            # Le site interdit la conservation de la page (contenu personnalisé ou sensible) : pas de mise en cache.
+            cacheable = 'no-store' not in page_response.headers.get('Cache-Control', '').lower()
+
+        content = bytes(body)
+        try:
+            encoding = declared_encoding or _detect_document_encoding(content)
+            text = _extract_text_with_lexbor(content, encoding)
+            if text is None:
+                if len(content) >= _REGEX_FALLBACK_MIN_BYTES:
+                    text = _extract_text_with_regex(content, encoding)
+                else:
+                    text = _extract_text_with_lxml(content, encoding)
+            full_text = _clean_extracted_text(text)[:8000]
+        except Exception as e:
+            # Une page malformée ne doit pas faire échouer les autres lectures lancées en parallèle.
+            error_message = f"Erreur lors de l'analyse du contenu de l'URL {url}: {e}"
+            logger.error(error_message)
+            return error_message
+
+        if cache_ttl > 0 and cacheable:
+            set_cached_page(url, full_text, timeout=cache_ttl)
+        return full_text
     except requests.exceptions.RequestException as e:
         error_message = f"Erreur lors de la lecture de l'URL {url}: {e}"
         logger.error(error_message)
         return error_message
+
+@celery.task()
+def read_webpage_task(url: str, no_cache: bool = False) -> str:
+    """
+    Scrape le contenu textuel d'une page web à partir de son URL.
+    Adaptateur Celery conservé pour la compatibilité ; la logique vit dans `_scrape_one`.
+    """
+    return _scrape_one(url, no_cache=no_cache)
@@ -1,4 +1,9 @@
+import json
 import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -6,3 +11,125 @@ logger = logging.getLogger(__name__)
 # Ce fichier est conservé pour la compatibilité des imports mais ne doit plus être modifié
 # pour la configuration des outils. La configuration est maintenant chargée dynamiquement
 # au démarrage de l'application.
+
+@dataclass(frozen=True, slots=True)
+class ToolSpec:
+    """Représentation figée d'un outil validé de tools_config.json, construite une seule fois au démarrage."""
+    name: str
+    type: str
+    description: str = ""
+    parameters: Dict[str, Any] = field(default_factory=dict)
+    execution_details: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_config(cls, tool):
+        return cls(
+            name=tool["name"],
+            type=tool["type"],
+            description=tool.get("description", ""),
+            parameters=tool.get("parameters", {}),
+            execution_details=tool.get("execution_details") or {},
+        )
+
+def _build_routing_examples(available_tools):
+    """Génère les exemples de sortie JSON attendus du LLM de routage, un par outil."""
+    tool_examples = []
+    for tool in available_tools:
+        tool_name = tool.get("name")
+        params = tool.get("parameters", {}).get("properties", {})
+        example_params = {p_name: f"valeur pour {p_name}" for p_name in params}
+        example_json = {"action": "call_tool", "tool_name": tool_name, "parameters": example_params}
+        tool_examples.append(f"- Pour utiliser l'outil '{tool_name}': {json.dumps(example_json)}")
+    return tool_examples
+
+def _build_openai_tools(available_tools):
+    """Convertit les outils de tools_config.json au format `tools` de l'API OpenAI (function calling)."""
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": tool.get("name"),
+                "description": tool.get("description", ""),
+                "parameters": tool.get("parameters", {"type": "object", "properties": {}}),
+            },
+        }
+        for tool in available_tools
+    ]
+
+_VALID_TOOL_TYPES = {"internal_function", "api_call", "search_and_read_webpage", "url_from_template"}
+
+def _build_decision_schema(available_tools):
+    """
+    Construit le schéma JSON d'une décision de routage, pour le décodage contraint (`response_format` de type
+    `json_schema`) : le backend ne peut produire qu'une action connue et un nom d'outil existant.
+    """
+    return {
+        "name": "routing_decision",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "action": {"type": "string", "enum": ["call_tool", "respond_directly"]},
+                "tool_name": {"type": "string", "enum": [tool.get("name") for tool in available_tools]},
+                "parameters": {"type": "object"},
+                "answer": {"type": "string"},
+            },
+            "required": ["action"],
+        },
+    }
+
+def _validate_tool(tool):
+    """
+    Vérifie la cohérence de la définition d'un outil et retourne la liste des problèmes trouvés.
+    Un schéma incohérent (ex: `required` citant un paramètre absent) pousse le LLM de routage
+    vers des décisions inexécutables, chacune coûtant un aller-retour complet pour rien.
+    """
+    if not isinstance(tool, dict):
+        return ["la définition n'est pas un objet JSON"]
+
+    problems = []
+    if not isinstance(tool.get("name"), str) or not tool.get("name"):
+        problems.append("champ 'name' manquant")
+    if tool.get("type") not in _VALID_TOOL_TYPES:
+        problems.append(f"type inconnu '{tool.get('type')}'")
+
+    schema = tool.get("parameters", {"type": "object", "properties": {}})
+    if not isinstance(schema, dict) or schema.get("type") != "object":
+        problems.append("'parameters' doit être un schéma JSON de type 'object'")
+        return problems
+
+    properties = schema.get("properties", {})
+    if not isinstance(properties, dict):
+        problems.append("'parameters.properties' doit être un objet")
+        return problems
+
+    required = schema.get("required", [])
+    if not isinstance(required, list):
+        problems.append("'parameters.required' doit être une liste")
+    else:
+        missing = [name for name in required if name not in properties]
+        if missing:
+            problems.append(f"paramètres requis non déclarés dans 'properties' : {missing}")
+    return problems
+
+def _initialize_tools(app):
+    """
+    Valide les outils déclarés puis pré-calcule leurs représentations, qui ne changent pas pendant la vie du processus.
+    La liste des outils étant figée au démarrage, on évite de la resérialiser à chaque requête.
+    """
+    available_tools = []
+    for tool in app.config.get('AVAILABLE_TOOLS', []):
+        problems = _validate_tool(tool)
+        if problems:
+            tool_name = tool.get("name") if isinstance(tool, dict) else tool
+            logger.error(f"Outil '{tool_name}' ignoré : définition invalide dans tools_config.json ({'; '.join(problems)}).")
+            continue
+        available_tools.append(tool)
+
+    app.config['AVAILABLE_TOOLS'] = available_tools
+    app.config['TOOLS_BY_NAME'] = {tool["name"]: ToolSpec.from_config(tool) for tool in available_tools}
+    # orjson conserve les caractères accentués tels quels (au lieu de séquences \uXXXX), ce qui allège le prompt.
+    app.config['AVAILABLE_TOOLS_JSON'] = orjson.dumps(available_tools, option=orjson.OPT_INDENT_2).decode()
+    app.config['ROUTING_TOOL_EXAMPLES'] = _build_routing_examples(available_tools)
+    app.config['AVAILABLE_TOOLS_OPENAI'] = _build_openai_tools(available_tools)
+    app.config['ROUTING_DECISION_SCHEMA'] = _build_decision_schema(available_tools)
+    logger.info(f"{len(available_tools)} outil(s) pré-calculé(s) pour le routage.")
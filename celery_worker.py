@@ -37,6 +37,20 @@ def init_celery_with_flask_app(app):
     if not celery.conf.broker_url:
         raise ValueError("Le broker Celery n'est pas configuré. Veuillez définir REDIS_URL ou CELERY_BROKER_URL.")
 
+    # --- Ordonnancement des tâches ---
+    # Un worker ne réserve qu'un message d'avance par slot : une longue orchestration ne bloque pas
+    # derrière elle des tâches courtes déjà prélevées par le même worker.
+    celery.conf.worker_prefetch_multiplier = int(app.config.get('CELERY_PREFETCH_MULTIPLIER', 1))
+
+    # Les lectures de pages et recherches envoyées via le broker (ex: DISTRIBUTED_SCRAPING) peuvent être
+    # isolées dans une file dédiée, servie par des workers adaptés aux E/S réseau.
+    if scrape_queue := app.config.get('CELERY_SCRAPE_QUEUE'):
+        app.logger.info(f"Routage des tâches de lecture web vers la file Celery '{scrape_queue}'.")
+        celery.conf.task_routes = {
+            'app.tasks.read_webpage_task': {'queue': scrape_queue},
+            'app.tasks.search_web_task': {'queue': scrape_queue},
+        }
+
     # --- Configuration de Celery Beat pour les tâches périodiques ---
     update_interval_minutes = int(app.config.get('llm_cache_update_interval_minutes', 5))
     app.logger.info(f"Configuration de la tâche de rafraîchissement du cache des modèles toutes les {update_interval_minutes} minutes.")
@@ -0,0 +1,40 @@
+import unittest
+
+from app.routing_heuristics import fast_route
+
+TOOLS = {"search_web", "read_webpage", "get_detailed_weather"}
+
+
+class FastRouteTestCase(unittest.TestCase):
+
+    def test_courtesy_and_arithmetic_are_answered_directly(self):
+        """Les salutations, remerciements et calculs ne passent pas par le LLM de routage."""
+        for question in ("Bonjour !", "merci beaucoup", "12 * (3 + 4) ?", "10 - 3", "2+2=", "-4 × 2,5 ?"):
+            self.assertEqual(fast_route(question, TOOLS), {"action": "respond_directly"}, question)
+
+    def test_dates_and_numbers_are_not_arithmetic(self):
+        """Dates, intervalles, numéros de téléphone ou nombres seuls ne sont pas pris pour des calculs."""
+        for question in ("2024-2025", "514-555-1234", "12/05/2024", "42", "(3)", "5 +"):
+            self.assertIsNone(fast_route(question, TOOLS), question)
+
+    def test_url_is_read(self):
+        """Une URL fournie par l'utilisateur est lue, sans doublon ni ponctuation finale."""
+        decision = fast_route("Résume https://example.com/a. et https://example.com/a", TOOLS)
+        self.assertEqual(decision["tool_name"], "read_webpage")
+        self.assertEqual(decision["parameters"], {"url": ["https://example.com/a"]})
+
+    def test_open_questions_go_to_the_router(self):
+        """Les questions sans signal évident restent confiées au LLM de routage."""
+        self.assertIsNone(fast_route("Bonjour, explique-moi la relativité", TOOLS))
+        self.assertIsNone(fast_route("Quel temps fera-t-il à Laval ?", TOOLS))
+
+    def test_today_does_not_trigger_a_search(self):
+        """Les questions de météo ou de date du jour restent confiées au routeur (outil météo, contexte temporel)."""
+        for question in ("Quelle est la météo aujourd'hui à Montréal ?", "Quel temps fait-il aujourd'hui à Laval ?",
+                         "Quel jour sommes-nous aujourd'hui ?"):
+            self.assertIsNone(fast_route(question, TOOLS), question)
+        self.assertEqual(fast_route("Les actualités du jour", TOOLS)["tool_name"], "search_web")
+
+
+if __name__ == '__main__':
+    unittest.main()
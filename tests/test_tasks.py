@@ -0,0 +1,179 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import eventlet
+import orjson
+from flask import Flask
+
+from app import tasks
+from app.tasks import (
+    _clean_extracted_text, _parse_llm_json, _read_webpages, _scrape_one, _select_relevant_passages, _select_urls_to_read,
+)
+
+
+class TextCleaningTestCase(unittest.TestCase):
+
+    def test_one_fragment_per_line(self):
+        """Les blancs multiples séparent des fragments, chacun sur sa propre ligne."""
+        text = "  Titre  \n\n\n  Premier   paragraphe  \r\n\tSuite\n"
+        self.assertEqual(_clean_extracted_text(text), "Titre\nPremier\nparagraphe\nSuite")
+
+    def test_single_spaces_are_preserved(self):
+        """Les espaces simples à l'intérieur d'une phrase ne sont pas modifiés."""
+        self.assertEqual(_clean_extracted_text("Il fait beau à Montréal"), "Il fait beau à Montréal")
+
+    def test_blank_text(self):
+        """Un texte composé uniquement de blancs donne une chaîne vide."""
+        self.assertEqual(_clean_extracted_text(" \n\t\r\n  "), "")
+
+
+class PassageSelectionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        filler = ["Lorem ipsum dolor sit amet, consectetur adipiscing elit."] * 40
+        self.text = "\n".join(filler[:20] + ["La météo à Montréal demain : 12 degrés et pluie légère."] + filler[20:])
+
+    def test_keeps_relevant_passage_within_budget(self):
+        """Le passage contenant les termes de la question est conservé et le budget est respecté."""
+        selected = _select_relevant_passages(self.text, "meteo montreal demain", 800)
+        self.assertLessEqual(len(selected), 800)
+        self.assertIn("Montréal demain", selected)
+
+    def test_falls_back_to_head_truncation(self):
+        """Sans terme commun avec la question, le début du texte est conservé."""
+        self.assertEqual(_select_relevant_passages(self.text, "xyz", 100), self.text[:100])
+
+    def test_short_text_is_untouched(self):
+        """Un texte déjà sous le budget est retourné tel quel."""
+        self.assertEqual(_select_relevant_passages("court", "météo", 2000), "court")
+
+
+class LlmJsonParsingTestCase(unittest.TestCase):
+
+    def test_plain_json(self):
+        """Un JSON valide est analysé directement."""
+        self.assertEqual(_parse_llm_json('{"action": "respond_directly"}'), {"action": "respond_directly"})
+
+    def test_markdown_fence_is_ignored(self):
+        """Le bloc markdown et le texte autour de l'objet JSON sont ignorés."""
+        text = 'Voici ma décision :\n```json\n{"action": "call_tool", "tool_name": "search_web"}\n```'
+        self.assertEqual(_parse_llm_json(text), {"action": "call_tool", "tool_name": "search_web"})
+
+    def test_invalid_json_raises(self):
+        """Une réponse sans objet JSON lève une erreur de décodage."""
+        with self.assertRaises(orjson.JSONDecodeError):
+            _parse_llm_json("Je ne sais pas.")
+
+
+class UrlSelectionTestCase(unittest.TestCase):
+
+    def test_skips_unreadable_results(self):
+        """Les fichiers binaires et les sites sans texte exploitable sont ignorés, l'ordre du classement est conservé."""
+        results = [
+            {"url": "https://www.youtube.com/watch?v=abc"},
+            {"url": "https://exemple.com/rapport.PDF"},
+            {"title": "sans url"},
+            {"url": "https://exemple.com/article"},
+            {"url": "https://inbox.com/page"},
+            {"url": "https://autre.org/"},
+        ]
+        self.assertEqual(_select_urls_to_read(results, 2), ["https://exemple.com/article", "https://inbox.com/page"])
+
+
+class ScrapingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        """Contexte applicatif minimal, sans cache de pages."""
+        app = Flask(__name__)
+        app.config['PAGE_CACHE_TTL'] = 0
+        self.app_context = app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def _scrape(self, body, content_type, encoding=None):
+        """Lit une page dont la réponse HTTP est simulée."""
+        response = MagicMock()
+        response.__enter__.return_value = response
+        response.headers = {'Content-Type': content_type}
+        response.encoding = encoding
+        response.iter_content.return_value = [body]
+        with patch.object(tasks._HTTP, 'get', return_value=response):
+            return _scrape_one("https://exemple.com/page")
+
+    def test_meta_charset_is_honoured(self):
+        """Sans charset dans l'en-tête HTTP, l'encodage déclaré par la balise <meta> est utilisé."""
+        body = '<html><head><meta charset="windows-1252"></head><body><p>Été à Montréal</p></body></html>'.encode('cp1252')
+        self.assertEqual(self._scrape(body, 'text/html'), "Été à Montréal")
+
+    def test_non_textual_content_is_rejected(self):
+        """Un document non textuel (PDF...) est refusé avant toute analyse."""
+        result = self._scrape(b'%PDF-1.7', 'application/pdf')
+        self.assertTrue(result.startswith("Erreur: Type de contenu non supporté"))
+
+    def test_truncated_utf8_body_stays_utf8(self):
+        """Un corps UTF-8 coupé au milieu d'un caractère multi-octets reste décodé en UTF-8."""
+        body = '<html><body><p>Été à Montréal</p><p>Écrit</p></body></html>'.encode('utf-8')
+        cut = body[:body.index('Écrit'.encode('utf-8')) + 1]
+        self.assertEqual(tasks._detect_document_encoding(cut), 'utf-8')
+        self.assertEqual(tasks._detect_document_encoding('Été'.encode('cp1252')), 'cp1252')
+
+    def test_inline_markup_stays_in_sentence(self):
+        """Les éléments en ligne ne coupent pas la phrase ; seuls les blocs sont séparés par un saut de ligne."""
+        body = ('<html><body><h1>Météo</h1><p>Il fera <b>12 degrés</b> demain à <a href="#">Montréal</a>, avec un\n'
+                '   risque de pluie.</p><ul><li>Lundi</li><li>Mardi</li></ul></body></html>').encode('utf-8')
+        expected = "Météo\nIl fera 12 degrés demain à Montréal, avec un risque de pluie.\nLundi\nMardi"
+        self.assertEqual(self._scrape(body, 'text/html; charset=utf-8', encoding='utf-8'), expected)
+        for extract in (tasks._extract_text_with_lxml, tasks._extract_text_with_regex):
+            with self.subTest(extract=extract.__name__):
+                self.assertEqual(_clean_extracted_text(extract(body, 'utf-8')), expected)
+
+    def test_unknown_header_charset_is_ignored(self):
+        """Un charset inconnu de Python dans l'en-tête HTTP ne fait pas échouer la lecture."""
+        body = '<html><body><p>Café crème</p></body></html>'.encode('utf-8')
+        self.assertEqual(self._scrape(body, 'text/html; charset=utf8mb4', encoding='utf8mb4'), "Café crème")
+
+    def test_parse_failure_returns_error_message(self):
+        """Une erreur d'analyse est convertie en message d'erreur au lieu d'interrompre les autres lectures."""
+        with patch.object(tasks, '_extract_text_with_lexbor', side_effect=RuntimeError("arbre invalide")):
+            result = self._scrape(b'<html><body>x</body></html>', 'text/html')
+        self.assertTrue(result.startswith("Erreur lors de l'analyse du contenu"))
+
+
+class ScrapePoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SCRAPE_POOL_SIZE'] = 2
+        self.pool_patch = patch.object(tasks, '_scrape_pool', None)
+        self.pool_patch.start()
+
+    def tearDown(self):
+        self.pool_patch.stop()
+
+    def test_pool_caps_concurrent_callers(self):
+        """La limite SCRAPE_POOL_SIZE s'applique à l'ensemble des orchestrations, pas à chaque appel."""
+        active, peak = [0], [0]
+
+        def fake_read(url):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            eventlet.sleep(0.01)
+            active[0] -= 1
+            return url
+
+        def caller(index):
+            with self.app.app_context():
+                return _read_webpages([f"https://exemple.com/{index}/{n}" for n in range(2)])
+
+        with patch.object(tasks, 'read_webpage_task', side_effect=fake_read):
+            callers = [eventlet.spawn(caller, index) for index in range(5)]
+            results = [c.wait() for c in callers]
+
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(results[3], ["https://exemple.com/3/0", "https://exemple.com/3/1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
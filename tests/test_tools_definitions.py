@@ -0,0 +1,30 @@
+import unittest
+
+from app.tools_definitions import _validate_tool
+
+
+class ToolValidationTestCase(unittest.TestCase):
+
+    def test_valid_tool(self):
+        """Un outil cohérent ne remonte aucun problème."""
+        tool = {
+            "name": "read_webpage",
+            "type": "internal_function",
+            "parameters": {"type": "object", "properties": {"url": {"type": "string"}}, "required": ["url"]},
+        }
+        self.assertEqual(_validate_tool(tool), [])
+
+    def test_required_parameter_must_be_declared(self):
+        """Un paramètre requis absent de 'properties' est signalé."""
+        tool = {
+            "name": "read_webpage",
+            "type": "internal_function",
+            "parameters": {"type": "object", "properties": {"url": {"type": "string"}}, "required": ["query"]},
+        }
+        problems = _validate_tool(tool)
+        self.assertEqual(len(problems), 1)
+        self.assertIn("query", problems[0])
+
+
+if __name__ == '__main__':
+    unittest.main()